@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'crelo.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# the live event streams (/projects/<pk>/events/, /locations/<pk>/events/), everything else goes to Django. Imported after
+# get_asgi_application() because it needs the apps loaded.
+from .sse import EventStreamApplication  # noqa: E402
+
+application = EventStreamApplication(django_application)
@@ -0,0 +1,128 @@
+import io
+import logging
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.handlers.wsgi import WSGIRequest
+from django.urls import Resolver404, resolve
+from rest_framework import permissions
+from rest_framework.exceptions import ParseError
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from projects import views as project_views
+from projects.renderers import FAST_RENDERER_CLASSES
+from users import views as user_views
+
+
+# Several read-only GETs in one HTTP call, e.g. everything a location page needs:
+#
+#   GET /batch/?request=/locations/1/&request=/project-categories/&request=/projects/%3Fids%3D1,2,3
+#
+# (each request= is url encoded, so a sub-request's own query string has to be encoded too). The response has one entry per
+# sub-request, in the same order: {"responses": [{"path": ..., "status": 200, "body": {...}}, ...]}.
+#
+# The sub-requests go straight to the views in projects/urls.py and users/urls.py, one after the other in this thread, so they
+# share this request's database connection (and replica, see crelo/routers.py). They don't go through the middleware. The user
+# is authenticated once for the whole batch and handed to every sub-request, and each view still checks its own permissions.
+#
+# Only the views in BATCHABLE_VIEWS can be batched: their GETs don't change anything (account/add-category/ and
+# account/remove-category/ do, and the replica pinning in crelo/routers.py wouldn't know about it) and return plain JSON. A
+# sub-request that fails gets its own error status, the rest of the batch still goes through.
+
+logger = logging.getLogger('crelo.batch')
+
+BATCH_URLCONFS = ('projects.urls', 'users.urls')
+
+BATCHABLE_VIEWS = (
+    project_views.LocationList,
+    project_views.LocationDetail,
+    project_views.LocationStats,
+    project_views.LocationActivity,
+    project_views.ProjectList,
+    project_views.ProjectListByLocation,
+    project_views.ProjectListByLocationAndCategory,
+    project_views.ProjectListFiltered,
+    project_views.ProjectDetail,
+    project_views.ProgressUpdateList,
+    project_views.ProgressUpdateDetail,
+    project_views.PledgeList,
+    project_views.PledgeDetail,
+    project_views.PledgetypeList,
+    project_views.PledgetypeDetail,
+    project_views.ProjectCategoryList,
+    project_views.ProjectCategoryDetail,
+    project_views.AllActivity,
+    user_views.CustomUserList,
+    user_views.CustomUserDetail,
+    user_views.AuthenticatedUserProfile,
+    user_views.AccountProjectList,
+    user_views.AccountPledgeList,
+)
+
+
+def resolve_batched(path):
+    for urlconf in BATCH_URLCONFS:
+        try:
+            return resolve(path, urlconf=urlconf)
+        except Resolver404:
+            continue
+    return None
+
+
+def make_subrequest(request, path, query_string):
+    environ = {
+        key: value for key, value in request._request.META.items()
+        # no conditional headers from the batch call, every sub-request gets a full response.
+        if not key.startswith('HTTP_IF_')
+    }
+    environ.update({
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': query_string,
+        'CONTENT_LENGTH': '0',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.url_scheme': request.scheme,
+    })
+    subrequest = WSGIRequest(environ)
+    if request.user.is_authenticated:
+        # DRF's Request uses these instead of running the authenticators again. Anonymous sub-requests do run them (there are
+        # no credentials to look up), so they still get a 401 with a WWW-Authenticate header rather than a 403.
+        subrequest._force_auth_user = request.user
+        subrequest._force_auth_token = request.auth
+    return subrequest
+
+
+class BatchView(APIView):
+
+    # every sub-request checks its own view's permissions.
+    permission_classes = [permissions.AllowAny]
+    renderer_classes = FAST_RENDERER_CLASSES
+
+    def get(self, request):
+        urls = request.query_params.getlist('request')
+        if not urls:
+            raise ParseError("Pass each sub-request as ?request=<url encoded path>.")
+        if len(urls) > settings.BATCH_MAX_REQUESTS:
+            raise ParseError(f"At most {settings.BATCH_MAX_REQUESTS} requests per batch.")
+
+        return Response({'responses': [self.run(request, url) for url in urls]})
+
+    def run(self, request, url):
+        path, _, query_string = url.partition('?')
+        match = resolve_batched(path) if path.startswith('/') else None
+        if match is None:
+            return {'path': url, 'status': 404, 'body': {'detail': "Not found."}}
+
+        if getattr(match.func, 'view_class', None) not in BATCHABLE_VIEWS:
+            return {'path': url, 'status': 400, 'body': {'detail': "This endpoint can't be batched."}}
+
+        try:
+            response = match.func(make_subrequest(request, path, query_string), *match.args, **match.kwargs)
+        except ObjectDoesNotExist:
+            # a view that looks something up without turning a missing row into an Http404 itself.
+            return {'path': url, 'status': 404, 'body': {'detail': "Not found."}}
+        except Exception:
+            logger.exception("Batched request %s failed", url)
+            return {'path': url, 'status': 500, 'body': {'detail': "Server error."}}
+        return {'path': url, 'status': response.status_code, 'body': response.data}
@@ -0,0 +1,245 @@
+import contextlib
+import contextvars
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from rest_framework import permissions, serializers
+from rest_framework.views import APIView
+
+
+# Per-request performance metrics.
+#
+# RequestMetricsMiddleware measures every request: the total time, the number of database queries and the time spent running them,
+# and the time spent in serializer.data (not counting any queries made while serializing). It adds these to the response
+# as a Server-Timing header, and adds them to histograms labelled with the view that handled the request.
+#
+# Each process keeps its own histograms in memory. If settings.METRICS['DIR'] is set, each process also writes them to
+# <DIR>/metrics-<pid>.json at most every FLUSH_INTERVAL seconds. MetricsView (/metrics) adds up all the files, so it shows
+# every gunicorn worker and not only the one that answered. The files of workers that have exited are kept so the counters
+# never go down. Clear the directory when the app is deployed.
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+HISTOGRAMS = {
+    'crelo_request_duration_seconds': ("Total time spent handling the request.", TIME_BUCKETS),
+    'crelo_db_duration_seconds': ("Time spent running database queries.", TIME_BUCKETS),
+    'crelo_serializer_duration_seconds': ("Time spent in serializer.data, without the queries it made.", TIME_BUCKETS),
+    'crelo_db_queries': ("Database queries per request.", QUERY_BUCKETS),
+}
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute_wrapper for every database connection while the request is handled.
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+
+def instrument_serializers():
+    # times serializer.data. Serializer.data and ListSerializer.data both go through BaseSerializer.data.
+    original = serializers.BaseSerializer.data
+    if getattr(original.fget, 'instrumented', False):
+        return
+
+    def data(serializer):
+        metrics = _current.get()
+        if metrics is None or metrics.serializer_depth:
+            # not in a request, or a serializer used inside another one's to_representation (already being timed).
+            return original.fget(serializer)
+
+        metrics.serializer_depth += 1
+        started = time.perf_counter()
+        db_time = metrics.db_time
+        try:
+            return original.fget(serializer)
+        finally:
+            metrics.serializer_depth -= 1
+            metrics.serializer_time += (time.perf_counter() - started) - (metrics.db_time - db_time)
+
+    data.instrumented = True
+    serializers.BaseSerializer.data = property(data)
+
+
+class MetricsStore:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.requests = {}
+        self.last_flush = time.monotonic()
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = (name,) + labels
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = {'buckets': [0] * len(buckets), 'sum': 0, 'count': 0}
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                histogram['buckets'][index] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+    def record(self, view, method, status, metrics, total):
+        labels = (view, method)
+        with self.lock:
+            self.observe('crelo_request_duration_seconds', labels, total)
+            self.observe('crelo_db_duration_seconds', labels, metrics.db_time)
+            self.observe('crelo_serializer_duration_seconds', labels, metrics.serializer_time)
+            self.observe('crelo_db_queries', labels, metrics.queries)
+            key = (view, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+        directory = settings.METRICS['DIR']
+        if directory and time.monotonic() - self.last_flush >= settings.METRICS['FLUSH_INTERVAL']:
+            self.flush(directory)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'histograms': [list(key) + [value['buckets'], value['sum'], value['count']] for key, value in self.histograms.items()],
+                'requests': [list(key) + [count] for key, count in self.requests.items()],
+            }
+
+    def flush(self, directory):
+        self.last_flush = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        # written to a temporary file and renamed, so MetricsView never reads half a file.
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+        with os.fdopen(descriptor, 'w') as temporary_file:
+            json.dump(self.snapshot(), temporary_file)
+        os.replace(temporary, os.path.join(directory, f"metrics-{os.getpid()}.json"))
+
+    def combined(self):
+        # this process's metrics plus every other process's latest file.
+        snapshots = [self.snapshot()]
+        directory = settings.METRICS['DIR']
+        if directory:
+            own_file = os.path.join(directory, f"metrics-{os.getpid()}.json")
+            for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+                if path == own_file:
+                    continue
+                try:
+                    with open(path) as metrics_file:
+                        snapshots.append(json.load(metrics_file))
+                except (OSError, ValueError):
+                    continue
+
+        histograms = {}
+        requests = {}
+        for snapshot in snapshots:
+            for name, view, method, buckets, total, count in snapshot['histograms']:
+                histogram = histograms.setdefault((name, view, method), {'buckets': [0] * len(buckets), 'sum': 0, 'count': 0})
+                histogram['buckets'] = [a + b for a, b in zip(histogram['buckets'], buckets)]
+                histogram['sum'] += total
+                histogram['count'] += count
+            for view, method, status, count in snapshot['requests']:
+                requests[(view, method, status)] = requests.get((view, method, status), 0) + count
+        return histograms, requests
+
+
+store = MetricsStore()
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        # keep unknown urls in one label, rather than one per path.
+        return 'unresolved'
+    view = getattr(match.func, 'view_class', match.func)
+    return view.__name__
+
+
+class RequestMetricsMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_serializers()
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            with contextlib.ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - started
+
+        response['Server-Timing'] = (
+            f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries", '
+            f'serialize;dur={metrics.serializer_time * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}'
+        )
+        store.record(view_name(request), request.method, response.status_code, metrics, total)
+        return response
+
+
+def label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def prometheus_text():
+    histograms, requests = store.combined()
+    lines = []
+
+    lines.append("# HELP crelo_requests_total Requests handled, by view, method and response status.")
+    lines.append("# TYPE crelo_requests_total counter")
+    for (view, method, status), count in sorted(requests.items()):
+        lines.append(f'crelo_requests_total{{view="{label(view)}",method="{method}",status="{status}"}} {count}')
+
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for (metric, view, method), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            labels = f'view="{label(view)}",method="{method}"'
+            for bound, count in zip(buckets, histogram['buckets']):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+            lines.append(f'{name}_sum{{{labels}}} {histogram["sum"]}')
+            lines.append(f'{name}_count{{{labels}}} {histogram["count"]}')
+
+    return "\n".join(lines) + "\n"
+
+
+class HasMetricsTokenOrIsAdmin(permissions.BasePermission):
+    # Prometheus scrapes with `Authorization: Bearer <METRICS['TOKEN']>`, admin users can log in and look too.
+
+    def has_permission(self, request, view):
+        token = settings.METRICS['TOKEN']
+        if token and request.META.get('HTTP_AUTHORIZATION') == f"Bearer {token}":
+            return True
+        return getattr(request.user, 'is_admin', False)
+
+
+class MetricsView(APIView):
+    permission_classes = [HasMetricsTokenOrIsAdmin]
+
+    def get(self, request):
+        return HttpResponse(prometheus_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
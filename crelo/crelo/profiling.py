@@ -0,0 +1,178 @@
+import contextlib
+import contextvars
+import cProfile
+import logging
+import os
+import random
+import time
+import traceback
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+
+# Two tools for finding out why something is slow in production.
+#
+# ProfilingMiddleware: an admin can add `?profile=1` or an `X-Profile: 1` header to any request. The request then runs under
+# cProfile (or pyinstrument, see settings.PROFILING), and the result is written to PROFILING['DIR'] (only the newest MAX_FILES
+# are kept). The file name is sent back in an X-Profile-File header. Use SAMPLE_RATE to only profile some of those requests,
+# e.g. when a script is hitting an endpoint over and over.
+#
+# Slow query log: any query slower than SLOW_QUERIES['THRESHOLD_MS'] is logged to the 'crelo.slow_queries' logger. The log
+# includes the SQL, its params, where it came from in projects/ or users/, and the database's EXPLAIN output. This runs for
+# every database connection, so management commands and the activity worker are logged too.
+
+logger = logging.getLogger('crelo.slow_queries')
+
+APP_DIRS = tuple(os.path.join(settings.BASE_DIR, app) + os.sep for app in ('projects', 'users'))
+
+
+def wants_profile(request):
+    return request.GET.get('profile') == '1' or request.META.get('HTTP_X_PROFILE') == '1'
+
+
+def is_admin(request):
+    # the middleware runs before DRF has authenticated the request, so do that here (only for requests asking to be profiled).
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        return getattr(drf_request.user, 'is_admin', False)
+    except Exception:
+        return False
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return getattr(match.func, 'view_class', match.func).__name__
+
+
+def rotate(directory, keep):
+    profiles = sorted(
+        (os.path.join(directory, name) for name in os.listdir(directory) if not name.startswith('.')),
+        key=os.path.getmtime
+    )
+    for path in profiles[:-keep] if keep else profiles:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class ProfilingMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not wants_profile(request) or random.random() >= settings.PROFILING['SAMPLE_RATE'] or not is_admin(request):
+            return self.get_response(request)
+
+        profiler = settings.PROFILING['PROFILER']
+        if profiler == 'cprofile':
+            response, write = self.run_cprofile(request)
+        elif profiler == 'pyinstrument':
+            response, write = self.run_pyinstrument(request)
+        else:
+            raise ImproperlyConfigured(f"PROFILING['PROFILER'] should be 'cprofile' or 'pyinstrument', not {profiler!r}.")
+
+        directory = settings.PROFILING['DIR']
+        os.makedirs(directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}-{view_label(request)}-{request.method}"
+        response['X-Profile-File'] = write(os.path.join(directory, name))
+        rotate(directory, settings.PROFILING['MAX_FILES'])
+        return response
+
+    def run_cprofile(self, request):
+        profile = cProfile.Profile()
+        response = profile.runcall(self.get_response, request)
+
+        def write(path):
+            # open it with `python -m pstats <file>` or snakeviz.
+            profile.dump_stats(path + '.prof')
+            return os.path.basename(path) + '.prof'
+        return response, write
+
+    def run_pyinstrument(self, request):
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImproperlyConfigured("PROFILING['PROFILER'] is 'pyinstrument' but pyinstrument isn't installed.")
+        profile = Profiler()
+        profile.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profile.stop()
+
+        def write(path):
+            with open(path + '.html', 'w') as profile_file:
+                profile_file.write(profile.output_html())
+            return os.path.basename(path) + '.html'
+        return response, write
+
+
+_explaining = contextvars.ContextVar('explaining_slow_query', default=False)
+
+
+def app_stack():
+    # the frames in our own code, innermost last.
+    frames = traceback.extract_stack()[:-3]
+    return [frame for frame in frames if frame.filename.startswith(APP_DIRS)]
+
+
+def explain(connection, sql, params):
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    token = _explaining.set(True)
+    try:
+        # inside a transaction the EXPLAIN gets a savepoint of its own, so if it fails (on Postgres that aborts the whole
+        # transaction) only the savepoint is rolled back and the request's own queries carry on.
+        with transaction.atomic(using=connection.alias) if connection.in_atomic_block else contextlib.nullcontext():
+            with connection.cursor() as cursor:
+                cursor.execute(connection.ops.explain_query_prefix() + ' ' + sql, params)
+                return "\n".join(" ".join(str(column) for column in row) for row in cursor.fetchall())
+    except Exception as error:
+        return f"EXPLAIN failed: {error}"
+    finally:
+        _explaining.reset(token)
+
+
+def log_slow_queries(connection):
+    def wrapper(execute, sql, params, many, context):
+        if _explaining.get():
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = (time.perf_counter() - started) * 1000
+
+        if duration >= settings.SLOW_QUERIES['THRESHOLD_MS']:
+            stack = "".join(traceback.format_list(app_stack())) or "  (not called from projects/ or users/)\n"
+            plan = explain(connection, sql, params) if settings.SLOW_QUERIES['EXPLAIN'] and not many else None
+            # the params are whatever was written or searched for (emails, password hashes, tokens), so they're left out unless asked for.
+            shown_params = repr(params) if settings.SLOW_QUERIES['LOG_PARAMS'] else f"({len(params or ())} hidden, see SLOW_QUERY_LOG_PARAMS)"
+            logger.warning(
+                "Slow query (%.1fms) on %s:\n%s\nparams: %s\nfrom:\n%s%s",
+                duration, connection.alias, sql, shown_params, stack,
+                f"plan:\n{plan}" if plan else "",
+            )
+        return result
+    wrapper.slow_query_log = True
+    return wrapper
+
+
+def install_slow_query_log(sender, connection, **kwargs):
+    # connection_created fires again whenever the connection reconnects, but execute_wrappers stays.
+    if any(getattr(wrapper, 'slow_query_log', False) for wrapper in connection.execute_wrappers):
+        return
+    # first in the list (outermost), because `with connection.execute_wrapper(...)` blocks pop the last one when they finish.
+    connection.execute_wrappers.insert(0, log_slow_queries(connection))
+
+
+connection_created.connect(install_slow_query_log, dispatch_uid='install_slow_query_log')
@@ -0,0 +1,70 @@
+import contextvars
+import hashlib
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+# Read/write splitting between the primary database ('default') and the read replicas in settings.DATABASE_REPLICAS.
+#
+# Writes always go to the primary. Reads go to a (random) replica only while handling a GET request, and not even then for
+# REPLICA_STICKY_SECONDS after the same client's last write (read-your-writes), since a replica might not have caught up yet.
+# Everything else (POST / PUT / DELETE requests, management commands, the shell) reads from the primary too.
+#
+# Clients are told apart by their Authorization header or session cookie. The "recently wrote" marker is kept in the
+# Django cache, so with several gunicorn workers this needs a shared cache (REDIS_URL).
+
+_read_from_replica = contextvars.ContextVar('read_from_replica', default=False)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # related objects come from the same database as the object they hang off.
+            return instance._state.db
+        if not _read_from_replica.get() or not settings.DATABASE_REPLICAS:
+            return 'default'
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas are copies of the primary, so everything can relate to everything.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+def pin_key(request):
+    client = request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not client:
+        return None
+    return "crelo:use-primary:" + hashlib.sha256(client.encode()).hexdigest()
+
+
+class ReplicaPinningMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        key = pin_key(request)
+        is_write = request.method not in SAFE_METHODS
+        recently_wrote = key is not None and cache.get(key, False)
+
+        token = _read_from_replica.set(not is_write and not recently_wrote)
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_from_replica.reset(token)
+
+        if is_write and key is not None and settings.DATABASE_REPLICAS:
+            cache.set(key, True, timeout=settings.REPLICA_STICKY_SECONDS)
+        return response
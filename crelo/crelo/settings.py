@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import tempfile
 import dj_database_url
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -61,16 +62,116 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ]
 }
 
+# Per-worker cache of token -> user for users.authentication.CachedTokenAuthentication. TTL (seconds) is also how long a deleted
+# token / changed user can still be used through another worker. STATS_HOOK is an optional dotted path to a function that gets
+# the cache's hit / miss stats every STATS_EVERY lookups.
+TOKEN_AUTH_CACHE = {
+    'SIZE': int(os.environ.get('TOKEN_AUTH_CACHE_SIZE', 10000)),
+    'TTL': int(os.environ.get('TOKEN_AUTH_CACHE_TTL', 60)),
+    'STATS_HOOK': os.environ.get('TOKEN_AUTH_CACHE_STATS_HOOK'),
+    'STATS_EVERY': int(os.environ.get('TOKEN_AUTH_CACHE_STATS_EVERY', 1000)),
+}
+
+# Page size for the paginated list views (see projects/pagination.py). Clients can ask for more with ?page_size= / ?limit=, up to MAX_PAGE_SIZE.
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 20))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 100))
+
+# Most sub-requests one call to /batch/ can make (see crelo/batch.py).
+BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', 20))
+
+# Local memory cache by default. Set REDIS_URL (e.g. with the Heroku Redis add-on) to share the cache between gunicorn workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'crelo',
+    }
+}
+
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+
+# Cached responses for the reference endpoints (see projects/cache.py). TIMEOUT is how long the server keeps them, MAX_AGE goes in the Cache-Control header.
+# A local memory cache is per worker and an edit only invalidates the worker that handled it, so without Redis the others
+# only catch up when their copy expires - keep that short.
+RESPONSE_CACHE = {
+    'TIMEOUT': int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 60 * 60 if os.environ.get('REDIS_URL') else 60)),
+    'MAX_AGE': int(os.environ.get('RESPONSE_CACHE_MAX_AGE', 0)),
+}
+
+# Pre-rendered activity feed for each location (see projects/feeds.py). SIZE is how many entries are kept per location.
+# BACKEND can be 'projects.feeds.DatabaseFeedBackend' or 'projects.feeds.LocMemFeedBackend'.
+ACTIVITY_FEED = {
+    'BACKEND': os.environ.get('ACTIVITY_FEED_BACKEND', 'projects.feeds.DatabaseFeedBackend'),
+    'SIZE': int(os.environ.get('ACTIVITY_FEED_SIZE', 200)),
+}
+
+# Live events for the Server-Sent Events streams (see projects/events.py and crelo/sse.py). The activity is made by run_activity_worker
+# in its own process, so it only reaches the web workers through Redis: RedisBroker is the default whenever REDIS_URL is set.
+# With LocalBroker (no Redis) the streams only get pledge totals, never activity, and run_activity_worker refuses to start
+# unless it's given --without-live-events.
+# KEEPALIVE is how often (seconds) an idle stream gets a comment line, so proxies don't close it.
+EVENTS = {
+    'BACKEND': os.environ.get('EVENTS_BACKEND', 'projects.events.RedisBroker' if os.environ.get('REDIS_URL') else 'projects.events.LocalBroker'),
+    'REDIS_URL': os.environ.get('REDIS_URL'),
+    'QUEUE_SIZE': int(os.environ.get('EVENTS_QUEUE_SIZE', 100)),
+    'KEEPALIVE': float(os.environ.get('EVENTS_KEEPALIVE', 15)),
+}
+
+# Request metrics (see crelo/metrics.py). Set DIR to a directory all the gunicorn workers can write to, so /metrics shows all of them.
+# TOKEN lets Prometheus scrape /metrics with an `Authorization: Bearer <token>` header (admin users can always see it).
+METRICS = {
+    'DIR': os.environ.get('METRICS_DIR'),
+    'FLUSH_INTERVAL': float(os.environ.get('METRICS_FLUSH_INTERVAL', 5)),
+    'TOKEN': os.environ.get('METRICS_TOKEN'),
+}
+
+# Profiling requests on demand (see crelo/profiling.py). PROFILER is 'cprofile', or 'pyinstrument' if that's installed.
+# SAMPLE_RATE is the fraction of requests asking to be profiled that actually are.
+PROFILING = {
+    'DIR': os.environ.get('PROFILING_DIR', os.path.join(tempfile.gettempdir(), 'crelo-profiles')),
+    'MAX_FILES': int(os.environ.get('PROFILING_MAX_FILES', 50)),
+    'SAMPLE_RATE': float(os.environ.get('PROFILING_SAMPLE_RATE', 1.0)),
+    'PROFILER': os.environ.get('PROFILING_PROFILER', 'cprofile'),
+}
+
+# Queries slower than THRESHOLD_MS are logged with a stack trace and (if EXPLAIN) their query plan.
+# LOG_PARAMS logs the query parameters too - they can be personal data, so only turn it on while debugging.
+SLOW_QUERIES = {
+    'THRESHOLD_MS': float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 200)),
+    'EXPLAIN': os.environ.get('SLOW_QUERY_EXPLAIN', 'True') != 'False',
+    'LOG_PARAMS': os.environ.get('SLOW_QUERY_LOG_PARAMS', 'False') == 'True',
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'crelo': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 AUTH_USER_MODEL = 'users.CustomUser'
 
 MIDDLEWARE = [
+    # first, so its timings cover everything below it. See crelo/metrics.py.
+    'crelo.metrics.RequestMetricsMiddleware',
+    # ?profile=1 for admins, see crelo/profiling.py.
+    'crelo.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    # decides whether this request's reads can go to a read replica, see crelo/routers.py.
+    'crelo.routers.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -152,4 +253,36 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 db_from_env = dj_database_url.config(conn_max_age=500)
-DATABASES['default'].update(db_from_env)
\ No newline at end of file
+DATABASES['default'].update(db_from_env)
+
+# SQLite (the default, and any sqlite:// DATABASE_URL) uses crelo/sqlite, which sets it up for several gunicorn workers: WAL,
+# BEGIN IMMEDIATE for transaction.atomic() and one writer at a time. SQLITE_TUNING=False goes back to Django's plain backend.
+# WAL is a setting stored in the database file itself: the committed db.sqlite3 is already in WAL mode, but any other SQLite
+# file is converted (once) the first time it's opened, and gets db.sqlite3-wal / -shm files next to it while in use (ignored by git).
+SQLITE = {
+    'TUNING': os.environ.get('SQLITE_TUNING', 'True') != 'False',
+    'SINGLE_WRITER': os.environ.get('SQLITE_SINGLE_WRITER', 'True') != 'False',
+    'BUSY_TIMEOUT_MS': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'MMAP_SIZE': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'CACHE_SIZE_KB': int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64 * 1024)),
+}
+if SQLITE['TUNING'] and DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default']['ENGINE'] = 'crelo.sqlite'
+
+# Read replicas. DATABASE_REPLICA_URLS is a comma separated list of database urls, they're added as replica1, replica2, ...
+# GET requests read from them and everything else uses 'default' (see crelo/routers.py). To try it locally with SQLite, copy
+# db.sqlite3 to replica.sqlite3 and set DATABASE_REPLICA_URLS=sqlite:////full/path/to/replica.sqlite3
+# Under test the replicas are mirrors of the test database rather than databases of their own (the routing itself is tested
+# with override_settings).
+DATABASE_REPLICAS = []
+replica_urls = os.environ.get('DATABASE_REPLICA_URLS', '')
+for number, url in enumerate(filter(None, replica_urls.split(',')), start=1):
+    alias = f'replica{number}'
+    DATABASES[alias] = dj_database_url.parse(url.strip(), conn_max_age=500)
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['crelo.routers.PrimaryReplicaRouter']
+
+# How long a client's reads stay on the primary after it writes something.
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
\ No newline at end of file
@@ -0,0 +1,155 @@
+import re
+import time
+
+from django.conf import settings
+from django.db import OperationalError
+from django.db.backends.signals import connection_created
+from django.db.backends.sqlite3 import base
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no flock, writers just wait on busy_timeout there.
+    fcntl = None
+
+
+# SQLite tuned for several gunicorn workers sharing one database file. Used instead of django.db.backends.sqlite3 unless
+# SQLITE_TUNING=False (see settings.SQLITE).
+#
+# - WAL journaling, so readers never block the writer and the writer never blocks readers. It's stored in the database file, so
+#   the first connection converts a file that isn't in WAL mode yet (the committed db.sqlite3 already is).
+# - synchronous=NORMAL, which is safe with WAL (a power cut can lose the last few commits, but can't corrupt the database).
+# - busy_timeout, mmap_size and cache_size from settings.SQLITE.
+# - transaction.atomic() blocks start with BEGIN IMMEDIATE, so they take the write lock up front. With a plain (deferred)
+#   BEGIN, a transaction that reads first and writes later can fail straight away with "database is locked" when another
+#   connection wrote in between, without waiting for busy_timeout.
+# - One writer at a time across all processes: write transactions (and writes outside a transaction) first take an flock on
+#   <database>.writer-lock, so writers queue up on that instead of all polling SQLite's lock. A writer waits at most
+#   busy_timeout for it, like it would for SQLite's own lock, and then gets the same "database is locked" OperationalError.
+#   atomic() blocks take it up front even if they turn out to only read, because they start with BEGIN IMMEDIATE (above) -
+#   keep read-only code out of atomic().
+
+WRITE_STATEMENT = re.compile(r'\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+
+
+class WriterLock:
+
+    def __init__(self, path, timeout):
+        self.path = path
+        self.timeout = timeout
+        self.file = None
+        self.held = False
+
+    def acquire(self):
+        if self.file is None:
+            self.file = open(self.path, 'a')
+        deadline = time.monotonic() + self.timeout
+        delay = 0.001
+        while True:
+            try:
+                fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise OperationalError("database is locked (timed out waiting for the writer lock)")
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, 0.05)
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+
+    def close(self):
+        self.release()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class SQLiteCursorWrapper(base.SQLiteCursorWrapper):
+    # takes the writer lock for writes made outside a transaction (e.g. a plain Model.save()).
+
+    def __init__(self, connection, writer_lock):
+        super().__init__(connection)
+        self.writer_lock = writer_lock
+
+    def execute(self, query, params=None):
+        if self.writer_lock is None or self.writer_lock.held or not WRITE_STATEMENT.match(query):
+            return super().execute(query, params)
+        self.writer_lock.acquire()
+        try:
+            return super().execute(query, params)
+        finally:
+            self.writer_lock.release()
+
+    def executemany(self, query, param_list):
+        if self.writer_lock is None or self.writer_lock.held:
+            return super().executemany(query, param_list)
+        self.writer_lock.acquire()
+        try:
+            return super().executemany(query, param_list)
+        finally:
+            self.writer_lock.release()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    writer_lock = None
+
+    def get_new_connection(self, conn_params):
+        # set up here rather than in __init__, because the test runner changes NAME to an in-memory database after that.
+        if settings.SQLITE['SINGLE_WRITER'] and fcntl is not None and not self.is_in_memory_db():
+            self.writer_lock = WriterLock(f"{self.settings_dict['NAME']}.writer-lock", settings.SQLITE['BUSY_TIMEOUT_MS'] / 1000)
+        else:
+            self.writer_lock = None
+        return super().get_new_connection(conn_params)
+
+    def create_cursor(self, name=None):
+        return self.connection.cursor(factory=lambda connection: SQLiteCursorWrapper(connection, self.writer_lock))
+
+    def _start_transaction_under_autocommit(self):
+        if self.writer_lock is not None:
+            self.writer_lock.acquire()
+        try:
+            self.cursor().execute("BEGIN IMMEDIATE")
+        except Exception:
+            if self.writer_lock is not None:
+                self.writer_lock.release()
+            raise
+
+    def _commit(self):
+        try:
+            return super()._commit()
+        finally:
+            if self.writer_lock is not None:
+                self.writer_lock.release()
+
+    def _rollback(self):
+        try:
+            return super()._rollback()
+        finally:
+            if self.writer_lock is not None:
+                self.writer_lock.release()
+
+    def _close(self):
+        try:
+            return super()._close()
+        finally:
+            if self.writer_lock is not None:
+                self.writer_lock.close()
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE['BUSY_TIMEOUT_MS'])}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE['MMAP_SIZE'])}")
+        # negative = size in KiB rather than pages.
+        cursor.execute(f"PRAGMA cache_size=-{int(settings.SQLITE['CACHE_SIZE_KB'])}")
+
+
+connection_created.connect(apply_pragmas, sender=DatabaseWrapper, dispatch_uid='sqlite_apply_pragmas')
@@ -0,0 +1,129 @@
+import asyncio
+import functools
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from projects.events import get_broker, pledge_total_event
+from projects.models import Location, Project
+
+
+# Server-Sent Events streams, for clients that would otherwise poll ProjectDetail / AllActivity:
+#
+#   GET /projects/<pk>/events/   pledge totals and activity for one project
+#   GET /locations/<pk>/events/  the same for every project in a location
+#
+# In the browser: new EventSource('/projects/1/events/').addEventListener('pledge-total', ...). See projects/events.py for the
+# events. A project stream starts with its current pledge-total, so the client doesn't need to fetch it separately.
+#
+# This is a plain ASGI app in front of Django (see crelo/asgi.py), because Django 3.0 views can't be async. Each open stream is
+# a coroutine waiting on its queue, not a thread, so a worker can hold thousands of idle ones. It only exists when the site is
+# served over ASGI (the Procfile runs gunicorn -k uvicorn.workers.UvicornWorker crelo.asgi), under WSGI these urls are 404s.
+
+STREAMS = (
+    (re.compile(r'^/projects/(?P<pk>\d+)/events/$'), 'project'),
+    (re.compile(r'^/locations/(?P<pk>\d+)/events/$'), 'location'),
+)
+
+
+def find_stream(scope):
+    if scope['type'] != 'http' or scope['method'] != 'GET':
+        return None
+    for pattern, kind in STREAMS:
+        match = pattern.match(scope['path'])
+        if match:
+            return kind, int(match.group('pk'))
+    return None
+
+
+def with_fresh_connections(function):
+    # these run in sync_to_async's threads outside Django's request handling, so nothing else fires request_started /
+    # request_finished to close connections that are past CONN_MAX_AGE or broken.
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return wrapper
+
+
+@with_fresh_connections
+def stream_exists(kind, pk):
+    model = Project if kind == 'project' else Location
+    return model.objects.filter(pk=pk).exists()
+
+
+@with_fresh_connections
+def first_events(kind, pk):
+    if kind != 'project':
+        return []
+    location_id, data = pledge_total_event(pk)
+    return [('pledge-total', data)] if data is not None else []
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {data}\n\n".encode()
+
+
+class EventStreamApplication:
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        stream = find_stream(scope)
+        if stream is None:
+            return await self.application(scope, receive, send)
+        return await self.stream(*stream, receive, send)
+
+    async def stream(self, kind, pk, receive, send):
+        if not await sync_to_async(stream_exists)(kind, pk):
+            await send({'type': 'http.response.start', 'status': 404, 'headers': [(b'content-type', b'text/plain')]})
+            await send({'type': 'http.response.body', 'body': b"Not found."})
+            return
+
+        broker = get_broker()
+        # subscribe before reading the current totals, so nothing can happen in between that the client never hears about.
+        subscription = broker.subscribe([f"{kind}-{pk}"])
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream'),
+                    (b'cache-control', b'no-cache'),
+                    # stops nginx from buffering the stream, if there's one in front.
+                    (b'x-accel-buffering', b'no'),
+                ],
+            })
+            for event, data in await sync_to_async(first_events)(kind, pk):
+                await send({'type': 'http.response.body', 'body': format_event(event, data), 'more_body': True})
+
+            disconnected = asyncio.ensure_future(self.wait_for_disconnect(receive))
+            try:
+                while True:
+                    next_event = asyncio.ensure_future(subscription.get())
+                    done, pending = await asyncio.wait({next_event, disconnected}, timeout=settings.EVENTS['KEEPALIVE'], return_when=asyncio.FIRST_COMPLETED)
+                    if disconnected in done:
+                        next_event.cancel()
+                        break
+                    if next_event in done:
+                        body = format_event(*next_event.result())
+                    else:
+                        next_event.cancel()
+                        body = b": keepalive\n\n"
+                    await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+            finally:
+                disconnected.cancel()
+        finally:
+            broker.unsubscribe(subscription)
+
+    async def wait_for_disconnect(self, receive):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
@@ -17,6 +17,9 @@ Including another URLconf
 from django.urls import path, include
 from rest_framework.authtoken.views import obtain_auth_token
 
+from .batch import BatchView
+from .metrics import MetricsView
+
 urlpatterns = [
     path('', include('projects.urls')),
     path('', include('users.urls')),
@@ -26,4 +29,10 @@ urlpatterns = [
 
     # token! So the API can remember the user is logged in.
     path('api-token-auth/', obtain_auth_token, name='api_token_auth'),
+
+    # request metrics for Prometheus, see crelo/metrics.py.
+    path('metrics', MetricsView.as_view()),
+
+    # several GETs in one call, see crelo/batch.py.
+    path('batch/', BatchView.as_view()),
 ]
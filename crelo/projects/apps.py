@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class ProjectsConfig(AppConfig):
     name = 'projects'
+
+    def ready(self):
+        # connects the post_save / post_delete receivers that invalidate cached responses.
+        from . import cache
+        # connects the connection_created receiver that sets up the slow query log.
+        from crelo import profiling
@@ -0,0 +1,89 @@
+import functools
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Pledgetype, ProjectCategory, Location
+
+
+# Response caching for the read-mostly reference endpoints (pledge types, categories, locations).
+#
+# Cached GET responses are stored in the Django cache (CACHES['default'], local memory unless REDIS_URL is set) under a key made of
+# the namespace's current version + the request's host, path and query params. Saving or deleting one of the models below bumps
+# its namespace's version, so every cached response for it is ignored from then on (and expires by itself later).
+# Responses also get an ETag, so clients can send If-None-Match and get an empty 304 back if nothing has changed.
+
+CACHED_MODELS = {
+    Pledgetype: 'pledgetypes',
+    ProjectCategory: 'categories',
+    Location: 'locations',
+}
+
+
+def version_key(namespace):
+    return f"crelo:response-version:{namespace}"
+
+
+def get_version(namespace):
+    return cache.get_or_set(version_key(namespace), 1, timeout=None)
+
+
+def invalidate(namespace):
+    try:
+        cache.incr(version_key(namespace))
+    except ValueError:
+        # not in the cache (e.g. it was evicted) - anything cached before is unreachable anyway.
+        cache.set(version_key(namespace), 1, timeout=None)
+
+
+def response_key(namespace, request):
+    query = sorted(request.query_params.lists())
+    request_id = json.dumps([request.get_host(), request.path, query])
+    digest = hashlib.md5(request_id.encode()).hexdigest()
+    return f"crelo:response:{namespace}:{get_version(namespace)}:{digest}"
+
+
+def make_etag(data):
+    content = json.dumps(data, sort_keys=True, default=str)
+    return '"%s"' % hashlib.md5(content.encode()).hexdigest()
+
+
+def cached_response(namespace):
+    # Decorator for an APIView's get(). Only 200 responses are cached.
+    def decorator(get):
+        @functools.wraps(get)
+        def wrapper(view, request, *args, **kwargs):
+            key = response_key(namespace, request)
+            cached = cache.get(key)
+
+            if cached is None:
+                response = get(view, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cached = {'data': response.data, 'etag': make_etag(response.data)}
+                cache.set(key, cached, settings.RESPONSE_CACHE['TIMEOUT'])
+
+            if request.META.get('HTTP_IF_NONE_MATCH') == cached['etag']:
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                response = Response(cached['data'])
+
+            response['ETag'] = cached['etag']
+            response['Cache-Control'] = f"max-age={settings.RESPONSE_CACHE['MAX_AGE']}, must-revalidate"
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidate_cached_model(sender, **kwargs):
+    invalidate(CACHED_MODELS[sender])
+
+
+for model in CACHED_MODELS:
+    post_save.connect(invalidate_cached_model, sender=model, dispatch_uid=f'invalidate_{model.__name__}_save')
+    post_delete.connect(invalidate_cached_model, sender=model, dispatch_uid=f'invalidate_{model.__name__}_delete')
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .feeds import render_activity
+from .models import Project
+from .rows import current_amount_pledged, current_percentage_pledged
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+# Live events for the Server-Sent Events streams (crelo/sse.py), so clients don't have to keep polling ProjectDetail / AllActivity.
+#
+# Channels are "project-<id>" and "location-<id>". Each gets:
+#   pledge-total  a project's new totals, after a pledge is made or deleted (PledgeList.post / PledgeDetail.delete)
+#   activity      a new Activity, rendered the same as in the location feeds (projects/outbox.py, send_last_chance_activity)
+# Events are published once the transaction that caused them has committed.
+#
+# Brokers need three methods:
+#   publish(channel, event, data)  - data is already JSON. Can be called from any thread.
+#   subscribe(channels)            - from the event loop, returns a Subscription to read events from
+#   unsubscribe(subscription)
+#
+# LocalBroker only reaches the streams in the same process. The activity events come from run_activity_worker, a process of its
+# own, and there's usually more than one web worker, so anywhere but a single local process this needs RedisBroker, which goes
+# through Redis pub/sub (the default when REDIS_URL is set).
+
+
+class Subscription:
+    # one stream's queue. Events are handed over to the event loop the stream runs on, so publishers don't need to be async.
+
+    def __init__(self, channels, loop, size):
+        self.channels = channels
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=size)
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # a client that stopped reading shouldn't hold on to everything that happens, it just misses events.
+            pass
+
+    async def get(self):
+        return await self.queue.get()
+
+
+def deliver(subscriptions, event):
+    for subscription in subscriptions:
+        subscription.put(event)
+
+
+class LocalBroker:
+
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self.subscriptions = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, channels):
+        subscription = Subscription(tuple(channels), asyncio.get_running_loop(), self.queue_size)
+        with self.lock:
+            for channel in subscription.channels:
+                self.subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                subscribers = self.subscriptions.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.subscriptions[channel]
+
+    def publish(self, channel, event, data):
+        self.dispatch(channel, event, data)
+
+    def dispatch(self, channel, event, data):
+        with self.lock:
+            subscribers = list(self.subscriptions.get(channel, ()))
+        # one call per event loop rather than per stream, waking a loop up from another thread isn't free.
+        by_loop = {}
+        for subscription in subscribers:
+            by_loop.setdefault(subscription.loop, []).append(subscription)
+        for loop, subscriptions in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(deliver, subscriptions, (event, data))
+            except RuntimeError:
+                # the event loop has been closed.
+                pass
+
+
+class RedisBroker(LocalBroker):
+    # Publishes through Redis, and one thread per process passes what comes back on to this process's streams.
+
+    prefix = 'crelo:events:'
+
+    def __init__(self, queue_size, url=None):
+        if redis is None:
+            raise ImproperlyConfigured("RedisBroker needs the redis package (pip install redis).")
+        if not url:
+            raise ImproperlyConfigured("RedisBroker needs EVENTS['REDIS_URL'] (or REDIS_URL).")
+        super().__init__(queue_size)
+        self.client = redis.Redis.from_url(url)
+        self.listener = None
+
+    def subscribe(self, channels):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(target=self.listen, name='crelo-events', daemon=True)
+                self.listener.start()
+        return super().subscribe(channels)
+
+    def publish(self, channel, event, data):
+        self.client.publish(self.prefix + channel, json.dumps([event, data]))
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.prefix + '*')
+                for message in pubsub.listen():
+                    event, data = json.loads(message['data'])
+                    self.dispatch(message['channel'].decode()[len(self.prefix):], event, data)
+            except redis.ConnectionError:
+                # Redis restarted, anything published in the meantime is lost.
+                time.sleep(1)
+
+
+_broker = None
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        broker_class = import_string(settings.EVENTS['BACKEND'])
+        options = {'url': settings.EVENTS['REDIS_URL']} if issubclass(broker_class, RedisBroker) else {}
+        _broker = broker_class(queue_size=settings.EVENTS['QUEUE_SIZE'], **options)
+    return _broker
+
+
+def pledge_total_event(project_id):
+    project = Project.objects.filter(pk=project_id).values(
+        'id', 'location_id', 'goal_amount', 'current_amount', 'pledge_count', 'last_milestone'
+    ).first()
+    if project is None:
+        return None, None
+    # the same keys as ProjectSerializer.
+    data = json.dumps({
+        'id': project['id'],
+        'current_amount_pledged': current_amount_pledged(project),
+        'current_percentage_pledged': current_percentage_pledged(project),
+        'pledge_count': project['pledge_count'],
+        'last_milestone': project['last_milestone'],
+    })
+    return project['location_id'], data
+
+
+def publish_pledge_total(project_id):
+    def publish():
+        location_id, data = pledge_total_event(project_id)
+        if data is not None:
+            broker = get_broker()
+            broker.publish(f"project-{project_id}", 'pledge-total', data)
+            broker.publish(f"location-{location_id}", 'pledge-total', data)
+    transaction.on_commit(publish)
+
+
+def publish_activity(activities):
+    # activities: new Activity rows, with ActivityFeedSerializer.setup_eager_loading.
+    events = [(activity.project_id, activity.location_id, render_activity(activity)) for activity in activities]
+
+    def publish():
+        broker = get_broker()
+        for project_id, location_id, data in events:
+            broker.publish(f"project-{project_id}", 'activity', data)
+            broker.publish(f"location-{location_id}", 'activity', data)
+    transaction.on_commit(publish)
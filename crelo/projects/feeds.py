@@ -0,0 +1,103 @@
+import collections
+import itertools
+import json
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework.renderers import JSONRenderer
+
+from .models import LocationFeedEntry
+from .serializers import ActivityFeedSerializer
+
+
+# Pre-rendered activity feed for each location.
+# Every time an Activity is recorded it also gets rendered (once) and appended to its location's feed, and the feed only keeps the newest ACTIVITY_FEED['SIZE'] entries.
+# So LocationActivity just reads back the stored JSON instead of querying Activity + projects + users on every request.
+#
+# Backends need three methods:
+#   append(activities)                      - add rendered entries for these activities
+#   read(location_id, before=None, limit)   - newest first, returns a list of (entry_id, data), entry_id is used as the "before" cursor for the next page
+#   clear(location_id=None)                 - empty one location's feed, or all of them
+
+
+def render_activity(activity):
+    return JSONRenderer().render(ActivityFeedSerializer(activity).data).decode()
+
+
+class DatabaseFeedBackend:
+    # Stored in the LocationFeedEntry table, reads are one range scan on the (location, -id) index.
+
+    def __init__(self, size):
+        self.size = size
+
+    def append(self, activities):
+        entries = LocationFeedEntry.objects.bulk_create([
+            LocationFeedEntry(location_id=activity.location_id, project_id=activity.project_id, data=render_activity(activity))
+            for activity in activities
+        ])
+        for location_id in {entry.location_id for entry in entries}:
+            self.trim(location_id)
+
+    def trim(self, location_id):
+        oldest_kept = (
+            LocationFeedEntry.objects.filter(location_id=location_id)
+            .order_by('-id')
+            .values_list('id', flat=True)[self.size - 1:self.size]
+        )
+        oldest_kept = list(oldest_kept)
+        if oldest_kept:
+            LocationFeedEntry.objects.filter(location_id=location_id, id__lt=oldest_kept[0]).delete()
+
+    def read(self, location_id, before=None, limit=20):
+        entries = LocationFeedEntry.objects.filter(location_id=location_id)
+        if before is not None:
+            entries = entries.filter(id__lt=before)
+        entries = entries.order_by('-id').values_list('id', 'data')[:limit]
+        return [(entry_id, json.loads(data)) for entry_id, data in entries]
+
+    def clear(self, location_id=None):
+        entries = LocationFeedEntry.objects.all()
+        if location_id is not None:
+            entries = entries.filter(location_id=location_id)
+        entries.delete()
+
+
+class LocMemFeedBackend:
+    # Kept in this process only - fine for development and tests, but each gunicorn worker gets its own feed and it's empty after a restart (run rebuild_activity_feed).
+
+    def __init__(self, size):
+        self.size = size
+        self.feeds = collections.defaultdict(lambda: collections.deque(maxlen=self.size))
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def append(self, activities):
+        rendered = [(activity.location_id, render_activity(activity)) for activity in activities]
+        with self.lock:
+            for location_id, data in rendered:
+                self.feeds[location_id].appendleft((next(self.ids), data))
+
+    def read(self, location_id, before=None, limit=20):
+        with self.lock:
+            entries = list(self.feeds.get(location_id, ()))
+        if before is not None:
+            entries = [entry for entry in entries if entry[0] < before]
+        return [(entry_id, json.loads(data)) for entry_id, data in entries[:limit]]
+
+    def clear(self, location_id=None):
+        with self.lock:
+            if location_id is None:
+                self.feeds.clear()
+            else:
+                self.feeds.pop(location_id, None)
+
+
+_backend = None
+
+def get_feed_backend():
+    global _backend
+    if _backend is None:
+        backend_class = import_string(settings.ACTIVITY_FEED['BACKEND'])
+        _backend = backend_class(size=settings.ACTIVITY_FEED['SIZE'])
+    return _backend
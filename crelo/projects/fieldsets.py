@@ -0,0 +1,31 @@
+from rest_framework.exceptions import ParseError
+
+
+# Sparse fieldsets for the project endpoints:
+#   ?fields=id,title,image  only these fields of each project (and only the columns they need are selected).
+#   ?expand=pledges         on a project's detail, only embed these of its related lists (updates, project_activity, pledges).
+#                           ?expand= with nothing after it embeds none of them. Without ?expand= all of them are embedded, as before.
+
+
+def parse_names(request, param, allowed, empty):
+    value = request.query_params.get(param)
+    if value is None:
+        return None
+    names = {name.strip() for name in value.split(',')} - {''}
+    if not names:
+        return empty
+
+    unknown = names - set(allowed)
+    if unknown:
+        raise ParseError(f"Unknown {param}: {', '.join(sorted(unknown))}. Choose from: {', '.join(allowed)}.")
+    # in the serializer's order, whatever order they were asked for in.
+    return tuple(name for name in allowed if name in names)
+
+
+def requested_fields(request, allowed):
+    # None (all of them) if ?fields= is missing or empty.
+    return parse_names(request, 'fields', tuple(allowed), empty=None)
+
+
+def requested_expansions(request, allowed):
+    return parse_names(request, 'expand', tuple(allowed), empty=())
@@ -0,0 +1,218 @@
+import json
+import math
+import re
+import statistics
+import time
+import urllib.error
+import urllib.request
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern
+from rest_framework.authtoken.models import Token
+
+import projects.urls
+import users.urls
+from projects.models import Project
+from users.models import CustomUser
+from users.views import UserAddCategory, UserRemoveCategory
+
+
+# Sample ids for the url kwargs. `pk` depends on which resource the url is for.
+PK_SOURCES = {
+    'locations': 'location',
+    'projects': 'project',
+    'users': 'user',
+    'pledges': 'pledgetype',
+    'project-categories': 'category',
+}
+
+# views whose GET changes something (the user's favourite categories), so they're left out rather than run over and over.
+WRITING_VIEWS = (UserAddCategory, UserRemoveCategory)
+
+KWARG_SOURCES = {
+    'loc_pk': 'location',
+    'cat_pk': 'category',
+    'project_pk': 'project',
+    'update_pk': 'update',
+    'pledge_pk': 'pledge',
+    'export_format': 'export_format',
+}
+
+
+def sample_ids():
+    # The busiest project that has progress updates (falling back to the busiest project), and the things it belongs to.
+    project = (
+        Project.objects.filter(updates__isnull=False).order_by('-pledge_count', 'id').first()
+        or Project.objects.order_by('-pledge_count', 'id').first()
+    )
+    if project is None:
+        raise CommandError("There are no projects to benchmark, run generate_dataset first.")
+    update = project.updates.order_by('id').first()
+    pledge = project.pledges.order_by('id').first()
+    return {
+        'project': project.id,
+        'location': project.location_id,
+        'category': project.category_id,
+        'pledgetype': project.pledgetype_id,
+        'user': project.user_id,
+        'update': update.id if update else None,
+        'pledge': pledge.id if pledge else None,
+        'export_format': 'csv',
+    }
+
+
+def bench_urls(ids):
+    # Every GET url in projects/urls.py and users/urls.py, filled in with the sample ids. Returns (route, url) pairs.
+    urls = []
+    for pattern in projects.urls.urlpatterns + users.urls.urlpatterns:
+        if not isinstance(pattern, URLPattern) or 'format' in pattern.pattern.regex.groupindex:
+            # skip the .json / .api copies added by format_suffix_patterns.
+            continue
+        if not hasattr(pattern.callback.view_class, 'get') or issubclass(pattern.callback.view_class, WRITING_VIEWS):
+            continue
+
+        route = str(pattern.pattern)
+        kwargs = {}
+        for name in pattern.pattern.converters:
+            if name == 'pk':
+                kwargs[name] = ids[PK_SOURCES[route.split('/')[0]]]
+            else:
+                kwargs[name] = ids[KWARG_SOURCES[name]]
+        if None in kwargs.values():
+            continue
+
+        url = route
+        for name, value in kwargs.items():
+            url = re.sub(rf'<(\w+:)?{name}>', str(value), url)
+        urls.append((route, '/' + url))
+    return urls
+
+
+def percentile(values, percent):
+    # nearest-rank percentile.
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Times every GET endpoint in projects/urls.py and users/urls.py and reports p50/p95/p99 latency (ms), queries per request and "
+        "response size. Runs in-process through the Django test client, or against a running server using the same database with --base-url "
+        "(queries can't be counted then). Use --save to keep the results as a baseline and --baseline to compare against one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help="Timed requests per url.")
+        parser.add_argument('--warmup', type=int, default=5, help="Untimed requests per url first.")
+        parser.add_argument('--base-url', help="e.g. http://127.0.0.1:8000 to benchmark a running gunicorn instead of the test client.")
+        parser.add_argument('--user', help="Username to authenticate as (default: the owner of the sample project).")
+        parser.add_argument('--save', help="Write the results to this JSON file.")
+        parser.add_argument('--baseline', help="Compare against results saved with --save.")
+        parser.add_argument('--threshold', type=float, default=10.0, help="Percent slower (p50) / bigger than the baseline that counts as a regression.")
+        parser.add_argument('--fail-on-regression', action='store_true', help="Exit with an error if anything regressed.")
+
+    def handle(self, *args, **options):
+        ids = sample_ids()
+        if options['user']:
+            user = CustomUser.objects.get(username=options['user'])
+        else:
+            user = CustomUser.objects.get(pk=ids['user'])
+        token, created = Token.objects.get_or_create(user=user)
+        headers = {'HTTP_AUTHORIZATION': f"Token {token.key}"}
+
+        if options['base_url']:
+            fetch = self.http_fetcher(options['base_url'].rstrip('/'), token.key)
+        else:
+            fetch = self.client_fetcher(Client(**headers))
+
+        results = {}
+        for route, url in bench_urls(ids):
+            for _ in range(options['warmup']):
+                fetch(url)
+
+            timings = []
+            query_counts = []
+            for _ in range(options['requests']):
+                status, size, queries, elapsed = fetch(url)
+                timings.append(elapsed * 1000)
+                if queries is not None:
+                    query_counts.append(queries)
+
+            results[route] = {
+                'url': url,
+                'status': status,
+                'p50': percentile(timings, 50),
+                'p95': percentile(timings, 95),
+                'p99': percentile(timings, 99),
+                'queries': statistics.median(query_counts) if query_counts else None,
+                'bytes': size,
+            }
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)['results']
+
+        regressions = self.report(results, baseline, options['threshold'])
+
+        if options['save']:
+            with open(options['save'], 'w') as save_file:
+                json.dump({'ids': ids, 'requests': options['requests'], 'results': results}, save_file, indent=2, sort_keys=True)
+            self.stdout.write(f"Saved results to {options['save']}")
+
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f"{regressions} url(s) regressed against {options['baseline']}.")
+
+    def client_fetcher(self, client):
+        def fetch(url):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = client.get(url)
+                content = b''.join(response.streaming_content) if response.streaming else response.content
+                elapsed = time.perf_counter() - started
+            return response.status_code, len(content), len(queries), elapsed
+        return fetch
+
+    def http_fetcher(self, base_url, token_key):
+        def fetch(url):
+            request = urllib.request.Request(base_url + url, headers={'Authorization': f"Token {token_key}"})
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request) as response:
+                    status, content = response.status, response.read()
+            except urllib.error.HTTPError as error:
+                status, content = error.code, error.read()
+            except urllib.error.URLError as error:
+                raise CommandError(f"Couldn't reach {base_url}: {error.reason}")
+            return status, len(content), None, time.perf_counter() - started
+        return fetch
+
+    def report(self, results, baseline, threshold):
+        self.stdout.write(f"{'url':<60} {'status':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'bytes':>8}")
+        regressions = 0
+        for route, result in results.items():
+            queries = '-' if result['queries'] is None else f"{result['queries']:g}"
+            line = (
+                f"{route:<60} {result['status']:>6} {result['p50']:>8.2f} {result['p95']:>8.2f} {result['p99']:>8.2f} "
+                f"{queries:>8} {result['bytes']:>8}"
+            )
+
+            before = (baseline or {}).get(route)
+            if before:
+                changes = []
+                if before['p50'] and result['p50'] > before['p50'] * (1 + threshold / 100):
+                    changes.append(f"p50 {before['p50']:.2f} -> {result['p50']:.2f}")
+                if before['queries'] is not None and result['queries'] is not None and result['queries'] > before['queries']:
+                    changes.append(f"queries {before['queries']:g} -> {result['queries']:g}")
+                if before['bytes'] and result['bytes'] > before['bytes'] * (1 + threshold / 100):
+                    changes.append(f"bytes {before['bytes']} -> {result['bytes']}")
+                if changes:
+                    regressions += 1
+                    line = self.style.ERROR(f"{line}  REGRESSED: {', '.join(changes)}")
+                elif result['p50'] < before['p50'] * (1 - threshold / 100):
+                    line = self.style.SUCCESS(f"{line}  faster (p50 was {before['p50']:.2f})")
+            self.stdout.write(line)
+        return regressions
@@ -0,0 +1,102 @@
+import logging
+import multiprocessing
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from rest_framework.authtoken.models import Token
+
+from projects.models import Project
+from users.models import CustomUser
+
+from .bench import percentile
+
+
+def run_worker(worker, duration, write_ratio, project_ids, token_key, results):
+    # one simulated gunicorn worker: a mix of project reads and pledges until `duration` is up.
+    rng = random.Random(worker)
+    # failed requests are counted below, don't print a traceback for each one.
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    client = Client(HTTP_AUTHORIZATION=f"Token {token_key}")
+    timings = {'read': [], 'write': []}
+    errors = {'read': 0, 'write': 0}
+    deadline = time.monotonic() + duration
+
+    while time.monotonic() < deadline:
+        project_id = rng.choice(project_ids)
+        kind = 'write' if rng.random() < write_ratio else 'read'
+        started = time.perf_counter()
+        try:
+            if kind == 'write':
+                response = client.post(
+                    f'/projects/{project_id}/pledges/',
+                    {'amount': 10, 'comment': "Benchmark", 'anonymous': True},
+                    content_type='application/json'
+                )
+            else:
+                response = client.get(rng.choice([f'/projects/{project_id}/', '/projects/', f'/projects/{project_id}/pledges/']))
+            ok = response.status_code < 500
+        except Exception:
+            # e.g. OperationalError: database is locked
+            ok = False
+        if ok:
+            timings[kind].append((time.perf_counter() - started) * 1000)
+        else:
+            errors[kind] += 1
+
+    connections.close_all()
+    results.put((timings, errors))
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs several processes reading projects and making pledges against the same database at once, and reports throughput, "
+        "latency and errors (e.g. \"database is locked\"). Compare SQLITE_TUNING=True (the default) with SQLITE_TUNING=False. "
+        "It makes real pledges, so use a copy of the database (e.g. one from generate_dataset)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help="Number of processes.")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds to run for.")
+        parser.add_argument('--write-ratio', type=float, default=0.2, help="Fraction of requests that are pledges.")
+
+    def handle(self, *args, **options):
+        project_ids = list(Project.objects.open().order_by('-pledge_count').values_list('id', flat=True)[:50])
+        user = CustomUser.objects.order_by('id').first()
+        if not project_ids or user is None:
+            raise CommandError("There are no open projects to benchmark, run generate_dataset first.")
+        token, created = Token.objects.get_or_create(user=user)
+
+        database = settings.DATABASES['default']
+        self.stdout.write(
+            f"{database['ENGINE']} ({database['NAME']}), {options['workers']} workers, {options['duration']:g}s, "
+            f"{options['write_ratio']:.0%} writes"
+        )
+
+        # the workers are forked, and mustn't share this process's database connection.
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        workers = [
+            context.Process(target=run_worker, args=(worker, options['duration'], options['write_ratio'], project_ids, token.key, results))
+            for worker in range(options['workers'])
+        ]
+        for worker in workers:
+            worker.start()
+        collected = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+
+        for kind in ('read', 'write'):
+            timings = [timing for worker_timings, errors in collected for timing in worker_timings[kind]]
+            error_count = sum(errors[kind] for worker_timings, errors in collected)
+            if not timings:
+                self.stdout.write(f"{kind + 's':<7} none completed, {error_count} errors")
+                continue
+            self.stdout.write(
+                f"{kind + 's':<7} {len(timings) / options['duration']:8.1f}/s  p50 {percentile(timings, 50):7.2f}ms  "
+                f"p99 {percentile(timings, 99):7.2f}ms  max {max(timings):8.2f}ms  {error_count} errors"
+            )
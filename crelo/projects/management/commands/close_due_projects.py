@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from projects.stats import close_due_projects
+
+
+class Command(BaseCommand):
+    help = "Takes the projects that have reached their due date out of the open totals in LocationCategoryStats. Meant to be run on a schedule (e.g. every 10 minutes from the Heroku scheduler, next to send_last_chance_activity)."
+
+    def handle(self, *args, **options):
+        closed = close_due_projects()
+        self.stdout.write(f"Closed {closed} project(s) in the location stats.")
@@ -0,0 +1,201 @@
+import io
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils.timezone import now
+
+from projects.models import Activity, Location, Pledge, Pledgetype, ProgressUpdate, Project, ProjectCategory
+from users.models import CustomUser
+
+
+# Sizes at --scale 1. Everything except the categories and pledge types grows linearly with the scale.
+LOCATIONS_PER_SCALE = 8
+USERS_PER_SCALE = 200
+PROJECTS_PER_SCALE = 100
+CATEGORIES = ["Arts", "Community", "Environment", "Education", "Sport", "Health", "Animals", "Food", "Music", "Technology"]
+PLEDGE_TYPES = ["money", "time", "items"]
+PLEDGE_AMOUNTS = [5, 10, 20, 25, 50, 100, 250, 1000]
+PLEDGE_AMOUNT_WEIGHTS = [10, 25, 20, 15, 15, 8, 5, 2]
+MAX_PLEDGES_PER_PROJECT = 2000
+
+WORDS = (
+    "community garden street party mural library dog park choir workshop repair cafe bike "
+    "festival market playground clean up beach river bushland tools school sports club"
+).split()
+
+
+def zipf_weights(count, exponent=1.1):
+    # a few items get most of the weight (popular locations, categories, projects), the rest share a long tail.
+    return [1 / (rank + 1) ** exponent for rank in range(count)]
+
+
+def bulk_create_ids(model, objects):
+    # bulk_create, then the new rows' ids in the same order (SQLite doesn't hand them back, see projects/outbox.py).
+    if connection.features.can_return_rows_from_bulk_insert:
+        model.objects.bulk_create(objects)
+        return [obj.pk for obj in objects]
+    last_id = model.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+    model.objects.bulk_create(objects)
+    return list(model.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True))
+
+
+def set_timestamps(model, field, ids, timestamps):
+    rows = [model(id=row_id, **{field: timestamp}) for row_id, timestamp in zip(ids, timestamps)]
+    model.objects.bulk_update(rows, [field], batch_size=500)
+
+
+class Command(BaseCommand):
+    help = (
+        "Adds a synthetic dataset for benchmarking: locations, categories, users (with favourite categories), projects, pledges, "
+        "progress updates and activity. Popularity is skewed, so a few locations / categories / projects get most of the users and pledges. "
+        "The same --scale and --seed always give the same data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=1, help=f"Size multiplier. --scale 1 is {PROJECTS_PER_SCALE} projects and {USERS_PER_SCALE} users.")
+        parser.add_argument('--seed', type=int, default=1, help="Random seed.")
+        parser.add_argument('--password', default='crelo-bench', help="Password for every generated user.")
+
+    def handle(self, *args, **options):
+        scale = options['scale']
+        rng = random.Random(options['seed'])
+        started = now()
+
+        with transaction.atomic():
+            # everything new gets a suffix from the current max user id, so running this twice doesn't clash on usernames.
+            run = (CustomUser.objects.aggregate(last_id=Max('id'))['last_id'] or 0) + 1
+
+            location_ids = bulk_create_ids(Location, [Location(name=f"Suburb {run}-{i}") for i in range(LOCATIONS_PER_SCALE * scale)])
+            category_ids = bulk_create_ids(ProjectCategory, [ProjectCategory(name=name) for name in CATEGORIES])
+            pledgetype_ids = bulk_create_ids(Pledgetype, [Pledgetype(type=type) for type in PLEDGE_TYPES])
+            location_weights = zipf_weights(len(location_ids))
+            category_weights = zipf_weights(len(category_ids))
+
+            # users
+            password = make_password(options['password'])
+            user_locations = rng.choices(location_ids, location_weights, k=USERS_PER_SCALE * scale)
+            user_ids = bulk_create_ids(CustomUser, [
+                CustomUser(username=f"user{run}-{i}", email=f"user{run}-{i}@example.com", password=password, location_id=location_id)
+                for i, location_id in enumerate(user_locations)
+            ])
+            users_by_location = {}
+            for user_id, location_id in zip(user_ids, user_locations):
+                users_by_location.setdefault(location_id, []).append(user_id)
+
+            Favourite = CustomUser.favourite_categories.through
+            favourites = []
+            for user_id in user_ids:
+                for category_id in set(rng.choices(category_ids, category_weights, k=rng.randint(0, 4))):
+                    favourites.append(Favourite(customuser_id=user_id, projectcategory_id=category_id))
+            Favourite.objects.bulk_create(favourites)
+
+            # projects, with their pledges worked out first so current_amount / pledge_count / last_milestone can be set straight away.
+            projects = []
+            project_plans = []
+            for i in range(PROJECTS_PER_SCALE * scale):
+                owner_index = rng.randrange(len(user_ids))
+                location_id = user_locations[owner_index]
+                created = started - timedelta(days=rng.uniform(0, 180))
+                due_date = created + timedelta(days=rng.uniform(7, 120))
+                goal_amount = rng.choice([500, 1000, 2500, 5000, 10000])
+
+                pledge_total = min(int(rng.paretovariate(1.2) * 3) - 3, MAX_PLEDGES_PER_PROJECT)
+                local_users = users_by_location[location_id]
+                pledges = [
+                    (
+                        # most pledges come from people in the same suburb.
+                        rng.choice(local_users) if rng.random() < 0.8 else rng.choice(user_ids),
+                        rng.choices(PLEDGE_AMOUNTS, PLEDGE_AMOUNT_WEIGHTS)[0]
+                    )
+                    for _ in range(pledge_total)
+                ]
+                current_amount = sum(amount for user_id, amount in pledges)
+
+                # same steps as Project.check_for_milestone.
+                percentage = int(current_amount / goal_amount * 100)
+                last_milestone = 0
+                while percentage > last_milestone + 25:
+                    last_milestone += 25
+
+                title = " ".join(rng.sample(WORDS, 3)).capitalize()
+                projects.append(Project(
+                    title=title,
+                    venue=f"{title} HQ",
+                    description=" ".join(rng.choices(WORDS, k=rng.randint(20, 120))),
+                    goal_amount=goal_amount,
+                    current_amount=current_amount,
+                    pledge_count=len(pledges),
+                    image="https://example.com/image.jpg",
+                    user_id=user_ids[owner_index],
+                    due_date=due_date,
+                    category_id=rng.choices(category_ids, category_weights)[0],
+                    location_id=location_id,
+                    last_milestone=last_milestone,
+                    pledgetype_id=rng.choice(pledgetype_ids),
+                ))
+                project_plans.append((created, pledges, max(int(rng.paretovariate(1.5)) - 1, 0)))
+
+            project_ids = bulk_create_ids(Project, projects)
+
+            pledges = []
+            pledge_times = []
+            updates = []
+            update_times = []
+            activity = []
+            for project_id, project, (created, project_pledges, update_count) in zip(project_ids, projects, project_plans):
+                last_activity = min(started, project.due_date)
+                for user_id, amount in project_pledges:
+                    pledges.append(Pledge(
+                        amount=amount, comment=" ".join(rng.choices(WORDS, k=5)), anonymous=rng.random() < 0.2,
+                        project_id=project_id, user_id=user_id, type_id=project.pledgetype_id
+                    ))
+                    pledge_times.append(created + (last_activity - created) * rng.random())
+
+                activity.append(Activity(action="project-created", datetime=created, user_id=project.user_id, project_id=project_id, location_id=project.location_id))
+                for milestone in range(25, project.last_milestone + 1, 25):
+                    activity.append(Activity(
+                        action=f"milestone-{milestone}", datetime=created + (last_activity - created) * milestone / (project.last_milestone + 25),
+                        user_id=project.user_id, project_id=project_id, location_id=project.location_id
+                    ))
+                for _ in range(min(update_count, 10)):
+                    posted = created + (last_activity - created) * rng.random()
+                    updates.append(ProgressUpdate(project_id=project_id, content=" ".join(rng.choices(WORDS, k=rng.randint(10, 60)))))
+                    update_times.append(posted)
+                    activity.append(Activity(
+                        action="progress-update", datetime=posted,
+                        user_id=project.user_id, project_id=project_id, location_id=project.location_id
+                    ))
+
+            pledge_ids = bulk_create_ids(Pledge, pledges)
+            update_ids = bulk_create_ids(ProgressUpdate, updates)
+            Activity.objects.bulk_create(sorted(activity, key=lambda item: item.datetime))
+
+            # date_created / date_posted are auto_now_add, so bulk_create stamped every row with the same "now". Spread them out
+            # afterwards, otherwise every -date_created page is one big tie broken by id.
+            set_timestamps(Project, 'date_created', project_ids, [created for created, project_pledges, update_count in project_plans])
+            set_timestamps(Pledge, 'date_created', pledge_ids, pledge_times)
+            set_timestamps(ProgressUpdate, 'date_posted', update_ids, update_times)
+
+            # the users' summary counters, the same as ProjectList.post / PledgeList.post would have left them.
+            user_totals = {user_id: CustomUser(id=user_id) for user_id in user_ids}
+            for project in projects:
+                user_totals[project.user_id].project_count += 1
+            for pledge in pledges:
+                user_totals[pledge.user_id].pledge_count += 1
+                user_totals[pledge.user_id].total_pledged += pledge.amount
+            CustomUser.objects.bulk_update(user_totals.values(), ['project_count', 'pledge_count', 'total_pledged'])
+
+            call_command('rebuild_location_stats', stdout=io.StringIO())
+            for location_id in location_ids:
+                call_command('rebuild_activity_feed', location=location_id, stdout=io.StringIO())
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(location_ids)} locations, {len(category_ids)} categories, {len(user_ids)} users, {len(project_ids)} projects, "
+            f"{len(pledges)} pledges, {len(updates)} progress updates and {len(activity)} activity in {(now() - started).total_seconds():.1f}s. "
+            f"Users are user{run}-0 to user{run}-{len(user_ids) - 1}, password '{options['password']}'."
+        ))
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from projects.feeds import get_feed_backend
+from projects.models import Activity, Location
+from projects.serializers import ActivityFeedSerializer
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the pre-rendered activity feed of every location (or just --location) from the Activity table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--location', type=int, help="Only rebuild this location's feed.")
+
+    def handle(self, *args, **options):
+        feed = get_feed_backend()
+        size = settings.ACTIVITY_FEED['SIZE']
+
+        locations = Location.objects.all()
+        if options['location'] is not None:
+            locations = locations.filter(pk=options['location'])
+
+        for location in locations:
+            # newest SIZE activities, appended oldest first so the feed ends up in the same order as if they'd come in live.
+            activity = ActivityFeedSerializer.setup_eager_loading(
+                Activity.objects.filter(location=location).order_by('-datetime', '-id')
+            )[:size]
+            activity = list(activity)[::-1]
+
+            with transaction.atomic():
+                feed.clear(location.id)
+                feed.append(activity)
+
+            self.stdout.write(f"{location}: {len(activity)} feed entries")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from projects.stats import rebuild_location_stats
+
+
+class Command(BaseCommand):
+    help = "Recalculates the LocationCategoryStats rollup (the /locations/<pk>/stats/ totals) from the open projects in one aggregate query."
+
+    def handle(self, *args, **options):
+        rows = rebuild_location_stats()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} location / category row(s)."))
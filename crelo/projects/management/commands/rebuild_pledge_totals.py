@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from projects.models import Project
+
+
+class Command(BaseCommand):
+    help = "Recalculates Project.current_amount and Project.pledge_count from the Pledge table and reports any projects that had drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Only report the drift, don't fix it."
+        )
+
+    def handle(self, *args, **options):
+        projects = Project.objects.annotate(
+            pledged_total=Sum('pledges__amount'),
+            pledged_count=Count('pledges')
+        ).only('id', 'current_amount', 'pledge_count')
+
+        drifted = 0
+        with transaction.atomic():
+            for project in projects:
+                actual_amount = project.pledged_total or 0
+                actual_count = project.pledged_count
+
+                if project.current_amount == actual_amount and project.pledge_count == actual_count:
+                    continue
+
+                drifted += 1
+                self.stdout.write(
+                    f"project {project.id}: current_amount {project.current_amount} -> {actual_amount}, "
+                    f"pledge_count {project.pledge_count} -> {actual_count}"
+                )
+
+                if not options['dry_run']:
+                    Project.objects.filter(pk=project.id).update(
+                        current_amount=actual_amount,
+                        pledge_count=actual_count,
+                        version=F('version') + 1
+                    )
+
+        if drifted == 0:
+            self.stdout.write(self.style.SUCCESS("All project pledge totals are correct."))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"{drifted} project(s) have drifted (dry run, nothing changed)."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Fixed pledge totals on {drifted} project(s)."))
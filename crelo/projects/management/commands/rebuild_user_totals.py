@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = "Recalculates CustomUser.project_count, pledge_count and total_pledged from the Project and Pledge tables and reports any users that had drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Only report the drift, don't fix it."
+        )
+
+    def handle(self, *args, **options):
+        # two separate queries, joining the projects and the pledges in one would multiply the rows together.
+        project_counts = dict(CustomUser.objects.annotate(owned_count=Count('user_projects')).values_list('id', 'owned_count'))
+        users = CustomUser.objects.annotate(
+            pledged_total=Sum('user_pledges__amount'),
+            pledged_count=Count('user_pledges')
+        ).only('id', 'project_count', 'pledge_count', 'total_pledged')
+
+        drifted = 0
+        with transaction.atomic():
+            for user in users:
+                actual_projects = project_counts[user.id]
+                actual_count = user.pledged_count
+                actual_total = user.pledged_total or 0
+
+                if (user.project_count, user.pledge_count, user.total_pledged) == (actual_projects, actual_count, actual_total):
+                    continue
+
+                drifted += 1
+                self.stdout.write(
+                    f"user {user.id}: project_count {user.project_count} -> {actual_projects}, "
+                    f"pledge_count {user.pledge_count} -> {actual_count}, total_pledged {user.total_pledged} -> {actual_total}"
+                )
+
+                if not options['dry_run']:
+                    CustomUser.objects.filter(pk=user.id).update(
+                        project_count=actual_projects,
+                        pledge_count=actual_count,
+                        total_pledged=actual_total
+                    )
+
+        if drifted == 0:
+            self.stdout.write(self.style.SUCCESS("All user totals are correct."))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"{drifted} user(s) have drifted (dry run, nothing changed)."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Fixed totals on {drifted} user(s)."))
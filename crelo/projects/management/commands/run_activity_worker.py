@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from projects.events import RedisBroker, get_broker
+from projects.outbox import process_outbox
+
+
+class Command(BaseCommand):
+    help = "Creates the Activity queued in the ActivityOutbox table, in batches. Runs until it's stopped, or use --once to just empty the outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="How many outbox rows to handle per transaction.")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to wait when the outbox is empty.")
+        parser.add_argument('--once', action='store_true', help="Exit as soon as the outbox is empty.")
+        parser.add_argument('--without-live-events', action='store_true', help="Run even though the activity can't reach the event streams.")
+
+    def handle(self, *args, **options):
+        # the activity is created in this process, only Redis gets it to the event streams in the web workers.
+        if not isinstance(get_broker(), RedisBroker) and not options['without_live_events']:
+            raise CommandError(
+                "The activity events need EVENTS_BACKEND=projects.events.RedisBroker (the default when REDIS_URL is set) to reach "
+                "the event streams from this process. Set REDIS_URL, or pass --without-live-events."
+            )
+
+        while True:
+            processed = process_outbox(batch_size=options['batch_size'])
+            if processed:
+                self.stdout.write(f"Created {processed} activity.")
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
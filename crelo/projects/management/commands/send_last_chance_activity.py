@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from projects.events import publish_activity
+from projects.feeds import get_feed_backend
+from projects.models import Project, Activity
+from projects.serializers import ActivityFeedSerializer
+
+
+LAST_CHANCE_DAYS = 5
+
+
+class Command(BaseCommand):
+    help = "Creates the \"last-chance\" activity for every open project that closes within the next 5 days. Meant to be run on a schedule (e.g. every 10 minutes from the Heroku scheduler)."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # one query on the (last_chance_triggered, due_date) index.
+            projects = list(
+                Project.objects.closing_within(LAST_CHANCE_DAYS)
+                .select_for_update()
+                .filter(last_chance_triggered=False)
+                .only('id', 'user_id', 'location_id')
+            )
+
+            Activity.objects.bulk_create([
+                Activity(action="last-chance", user_id=project.user_id, project_id=project.id, location_id=project.location_id)
+                for project in projects
+            ])
+            Project.objects.filter(pk__in=[project.id for project in projects]).update(last_chance_triggered=True, version=F('version') + 1)
+
+            # bulk_create doesn't give us the ids back on every database, so fetch the new rows again for the location feeds.
+            new_activity = ActivityFeedSerializer.setup_eager_loading(
+                Activity.objects.filter(action="last-chance", project_id__in=[project.id for project in projects])
+            )
+            new_activity = list(new_activity.order_by('id'))
+            get_feed_backend().append(new_activity)
+            publish_activity(new_activity)
+
+        self.stdout.write(f"Created last-chance activity for {len(projects)} project(s).")
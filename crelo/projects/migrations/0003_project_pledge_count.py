@@ -0,0 +1,29 @@
+# Generated by Django 3.0.8 on 2026-10-18 07:06
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_pledge_totals(apps, schema_editor):
+    Project = apps.get_model('projects', 'Project')
+    projects = Project.objects.annotate(total=Sum('pledges__amount'), count=Count('pledges'))
+    for project in projects:
+        project.current_amount = project.total or 0
+        project.pledge_count = project.count
+        project.save(update_fields=['current_amount', 'pledge_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0002_auto_20200904_2332'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='pledge_count',
+            field=models.IntegerField(blank=True, default=0),
+        ),
+        migrations.RunPython(backfill_pledge_totals, migrations.RunPython.noop),
+    ]
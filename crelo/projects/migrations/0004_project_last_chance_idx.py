@@ -0,0 +1,17 @@
+# Generated by Django 3.0.8 on 2026-10-18 07:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0003_project_pledge_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['last_chance_triggered', 'due_date'], name='project_last_chance_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.0.8 on 2026-10-18 07:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0004_project_last_chance_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['datetime', 'id'], name='activity_datetime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pledge',
+            index=models.Index(fields=['project', 'date_created', 'id'], name='pledge_project_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='progressupdate',
+            index=models.Index(fields=['project', 'date_posted', 'id'], name='update_project_posted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['date_created', 'id'], name='project_created_idx'),
+        ),
+    ]
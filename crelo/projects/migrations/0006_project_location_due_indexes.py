@@ -0,0 +1,21 @@
+# Generated by Django 3.0.8 on 2026-10-18 07:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0005_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['location', 'due_date'], name='project_location_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['location', 'category', 'due_date'], name='project_loc_cat_due_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.8 on 2026-10-18 07:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0006_project_location_due_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['location', '-datetime', '-id'], name='activity_location_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.0.8 on 2026-10-18 07:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0007_activity_location_feed_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationFeedEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.TextField()),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='projects.Location')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='projects.Project')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='locationfeedentry',
+            index=models.Index(fields=['location', '-id'], name='feed_entry_location_idx'),
+        ),
+    ]
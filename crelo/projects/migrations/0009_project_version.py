@@ -0,0 +1,18 @@
+# Generated by Django 3.0.8 on 2026-10-18 07:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0008_locationfeedentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='version',
+            field=models.IntegerField(blank=True, default=0),
+        ),
+    ]
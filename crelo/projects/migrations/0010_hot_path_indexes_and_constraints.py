@@ -0,0 +1,33 @@
+# Generated by Django 3.0.8 on 2026-10-18 07:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0009_project_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pledge',
+            index=models.Index(fields=['project', '-amount', '-date_created'], name='pledge_project_amount_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='pledge',
+            constraint=models.CheckConstraint(check=models.Q(amount__gt=0), name='pledge_amount_positive'),
+        ),
+        migrations.AddConstraint(
+            model_name='project',
+            constraint=models.CheckConstraint(check=models.Q(goal_amount__gt=0), name='project_goal_amount_positive'),
+        ),
+        migrations.AddConstraint(
+            model_name='project',
+            constraint=models.CheckConstraint(check=models.Q(current_amount__gte=0), name='project_current_amount_not_negative'),
+        ),
+        migrations.AddConstraint(
+            model_name='project',
+            constraint=models.CheckConstraint(check=models.Q(pledge_count__gte=0), name='project_pledge_count_not_negative'),
+        ),
+    ]
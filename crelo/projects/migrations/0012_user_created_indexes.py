@@ -0,0 +1,21 @@
+# Generated by Django 3.0.8 on 2026-10-18 07:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0011_activityoutbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pledge',
+            index=models.Index(fields=['user', 'date_created', 'id'], name='pledge_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['user', 'date_created', 'id'], name='project_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 3.0.8 on 2026-10-18 07:40
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.utils.timezone import now
+import django.db.models.deletion
+
+
+def backfill_location_stats(apps, schema_editor):
+    # the same as the rebuild_location_stats command.
+    Project = apps.get_model('projects', 'Project')
+    LocationCategoryStats = apps.get_model('projects', 'LocationCategoryStats')
+    current_time = now()
+    totals = Project.objects.filter(due_date__gt=current_time).values('location_id', 'category_id').annotate(
+        open_project_count=Count('id'),
+        total_goal=Sum('goal_amount'),
+        total_pledged=Sum('current_amount'),
+        pledge_count=Sum('pledge_count'),
+    ).order_by()
+    LocationCategoryStats.objects.bulk_create([LocationCategoryStats(**row) for row in totals])
+    Project.objects.filter(due_date__lte=current_time).update(counted_open=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0012_user_created_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationCategoryStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('open_project_count', models.IntegerField(default=0)),
+                ('total_goal', models.IntegerField(default=0)),
+                ('total_pledged', models.IntegerField(default=0)),
+                ('pledge_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='counted_open',
+            field=models.BooleanField(blank=True, default=True),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['counted_open', 'due_date'], name='project_counted_open_idx'),
+        ),
+        migrations.AddField(
+            model_name='locationcategorystats',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='location_stats', to='projects.ProjectCategory'),
+        ),
+        migrations.AddField(
+            model_name='locationcategorystats',
+            name='location',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_stats', to='projects.Location'),
+        ),
+        migrations.AddConstraint(
+            model_name='locationcategorystats',
+            constraint=models.UniqueConstraint(fields=('location', 'category'), name='location_category_stats_unique'),
+        ),
+        migrations.RunPython(backfill_location_stats, migrations.RunPython.noop),
+    ]
@@ -26,12 +26,31 @@ class Pledgetype(models.Model):
     type = models.CharField(max_length=50)
     
 
+class ProjectQuerySet(models.QuerySet):
+    # Same as Project.is_open but done in the database, so we don't have to load every project (open and closed) just to throw most of them away.
+
+    def open(self):
+        return self.filter(due_date__gt=now())
+
+    def closed(self):
+        return self.filter(due_date__lte=now())
+
+    def closing_within(self, days):
+        current_time = now()
+        return self.filter(due_date__gt=current_time, due_date__lt=current_time + timedelta(days=days))
+
+    def touch(self):
+        # Bump the version of these projects. Needs to be called after anything that changes what ProjectDetail / PledgeList return, it's what their ETags are made from.
+        return self.update(version=models.F('version') + 1)
+
+
 class Project(models.Model):
     title = models.CharField(max_length=200)
     venue = models.CharField(max_length=200, blank=True)
     description = models.TextField()
     goal_amount = models.IntegerField()
     current_amount = models.IntegerField(default=0, blank=True)
+    pledge_count = models.IntegerField(default=0, blank=True)
     image = models.URLField()
     date_created = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(
@@ -55,15 +74,44 @@ class Project(models.Model):
         on_delete=models.PROTECT)
     # Need to keep track of this so the activity object for "last-chance" to pledge is only created once.
     last_chance_triggered = models.BooleanField(default=False, blank=True)
+    # True while the project is counted as open in LocationCategoryStats. The close_due_projects command takes it back out once it's past its due date (see projects/stats.py).
+    counted_open = models.BooleanField(default=True, blank=True)
+    # goes up by one every time the project, its pledges, updates or activity change (see ProjectQuerySet.touch).
+    version = models.IntegerField(default=0, blank=True)
+
+    objects = ProjectQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # used by the send_last_chance_activity command to find projects that are about to close.
+            models.Index(fields=['last_chance_triggered', 'due_date'], name='project_last_chance_idx'),
+            # projects that have closed but are still counted as open in LocationCategoryStats.
+            models.Index(fields=['counted_open', 'due_date'], name='project_counted_open_idx'),
+            # ordering for the ProjectList cursor pagination.
+            models.Index(fields=['date_created', 'id'], name='project_created_idx'),
+            # open projects for a location (and category), see ProjectListByLocation / ProjectListByLocationAndCategory.
+            models.Index(fields=['location', 'due_date'], name='project_location_due_idx'),
+            models.Index(fields=['location', 'category', 'due_date'], name='project_loc_cat_due_idx'),
+            # a user's own projects on the account page (AccountProjectList), newest first.
+            models.Index(fields=['user', 'date_created', 'id'], name='project_user_created_idx'),
+        ]
+        constraints = [
+            # current_percentage_pledged divides by goal_amount.
+            models.CheckConstraint(check=models.Q(goal_amount__gt=0), name='project_goal_amount_positive'),
+            models.CheckConstraint(check=models.Q(current_amount__gte=0), name='project_current_amount_not_negative'),
+            models.CheckConstraint(check=models.Q(pledge_count__gte=0), name='project_pledge_count_not_negative'),
+        ]
 
     @property
     def is_open(self):
         return self.due_date > now()
     
+    # current_amount and pledge_count are kept up to date by PledgeList.post and PledgeDetail.delete (see rebuild_pledge_totals command if they ever drift), so no need to aggregate over the pledges here.
     @property
     def current_amount_pledged(self):
-        current_amt = self.pledges.aggregate(value=Sum('amount'))
-        return current_amt['value']
+        if self.pledge_count:
+            return self.current_amount
+        return None
 
     @property
     def current_percentage_pledged(self):
@@ -71,6 +119,30 @@ class Project(models.Model):
             return int(self.current_amount_pledged / self.goal_amount * 100)
         return 0
 
+    def check_for_milestone(self):
+        # Called whenever the pledged total changes. Moves last_milestone up past every 25% step that has been crossed and returns the newly reached milestones so the caller can create the activity for them.
+        if not self.is_open:
+            return []
+
+        milestone = self.last_milestone
+        while self.current_percentage_pledged > float(milestone + 25):
+            milestone += 25
+
+        if milestone == self.last_milestone:
+            return []
+
+        # only update if nobody else got there first, otherwise two pledges at the same time would both announce the same milestone.
+        updated = Project.objects.filter(pk=self.pk, last_milestone=self.last_milestone).update(
+            last_milestone=milestone,
+            version=models.F('version') + 1
+        )
+        if not updated:
+            return []
+
+        reached = list(range(self.last_milestone + 25, milestone + 1, 25))
+        self.last_milestone = milestone
+        return reached
+
 
 class Pledge(models.Model):
     amount = models.IntegerField()
@@ -93,11 +165,30 @@ class Pledge(models.Model):
         related_name='pledgetype'
     )
 
+    class Meta:
+        indexes = [
+            # ordering for the PledgeList cursor pagination.
+            models.Index(fields=['project', 'date_created', 'id'], name='pledge_project_created_idx'),
+            # ProjectDetailSerializer lists the pledges biggest first.
+            models.Index(fields=['project', '-amount', '-date_created'], name='pledge_project_amount_idx'),
+            # a user's own pledges on the account page (AccountPledgeList), newest first.
+            models.Index(fields=['user', 'date_created', 'id'], name='pledge_user_created_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(check=models.Q(amount__gt=0), name='pledge_amount_positive'),
+        ]
+
 class ProgressUpdate(models.Model):
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='updates')
     date_posted = models.DateTimeField(auto_now_add=True)
     content = models.TextField()
 
+    class Meta:
+        indexes = [
+            # ordering for the ProgressUpdateList cursor pagination.
+            models.Index(fields=['project', 'date_posted', 'id'], name='update_project_posted_idx'),
+        ]
+
 # Activity possible actions: 
     # - project reaches goal amount (and 25%, 50% and 75%)
     # - creator posts a progress update
@@ -106,7 +197,8 @@ class ProgressUpdate(models.Model):
 
 class Activity(models.Model):
     action = models.CharField(max_length=200)
-    datetime = models.DateTimeField(auto_now_add=True)
+    # not auto_now_add, so activity written later by the outbox worker keeps the time it actually happened.
+    datetime = models.DateTimeField(default=now)
     
     user = models.ForeignKey(
         get_user_model(), 
@@ -124,6 +216,79 @@ class Activity(models.Model):
         related_name='project_activity'
     )
 
+    class Meta:
+        indexes = [
+            # ordering for the AllActivity cursor pagination.
+            models.Index(fields=['datetime', 'id'], name='activity_datetime_idx'),
+            # per-location feed, see LocationActivity.
+            models.Index(fields=['location', '-datetime', '-id'], name='activity_location_feed_idx'),
+        ]
+
+
+class ActivityOutbox(models.Model):
+    # Activity waiting to be created by the run_activity_worker command (see projects/outbox.py).
+    action = models.CharField(max_length=200)
+    datetime = models.DateTimeField(default=now)
+    user = models.ForeignKey(
+        get_user_model(),
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    location = models.ForeignKey(
+        Location,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    project = models.ForeignKey(
+        Project,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+
+
+class LocationFeedEntry(models.Model):
+    # An Activity already rendered to JSON for its location's feed, see projects/feeds.py.
+    location = models.ForeignKey(
+        Location,
+        on_delete=models.CASCADE,
+        related_name='feed_entries'
+    )
+    project = models.ForeignKey(
+        Project,
+        on_delete=models.CASCADE,
+        related_name='feed_entries'
+    )
+    data = models.TextField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['location', '-id'], name='feed_entry_location_idx'),
+        ]
+
+
+
+class LocationCategoryStats(models.Model):
+    # Totals of the open projects for each (location, category), for LocationStats (/locations/<pk>/stats/). Kept up to date
+    # by the project and pledge views through projects/stats.py - see the rebuild_location_stats command if they ever drift.
+    location = models.ForeignKey(
+        Location,
+        on_delete=models.CASCADE,
+        related_name='category_stats'
+    )
+    category = models.ForeignKey(
+        ProjectCategory,
+        on_delete=models.CASCADE,
+        related_name='location_stats'
+    )
+    open_project_count = models.IntegerField(default=0)
+    total_goal = models.IntegerField(default=0)
+    total_pledged = models.IntegerField(default=0)
+    pledge_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['location', 'category'], name='location_category_stats_unique'),
+        ]
     
 
 # SHELL COMMANDS #
@@ -0,0 +1,52 @@
+from django.db import connection, transaction
+from django.db.models import Max
+
+from .events import publish_activity
+from .feeds import get_feed_backend
+from .models import Activity, ActivityOutbox, Project
+from .serializers import ActivityFeedSerializer
+
+
+# Activity is written in two steps so creating it doesn't slow down the request that caused it:
+#   1. activity_signal_receiver only inserts a small ActivityOutbox row, in the same transaction as the pledge / project / update that triggered it.
+#   2. the run_activity_worker command picks the outbox rows up in batches, creates the Activity rows with one bulk_create,
+#      appends them to the location feeds, publishes them to the live event streams (projects/events.py) and bumps the projects' versions, then deletes the outbox rows.
+
+
+def emit_activity(action, user, project, location):
+    return ActivityOutbox.objects.create(action=action, user=user, project=project, location=location)
+
+
+def process_outbox(batch_size=100):
+    # Creates the Activity for (up to) batch_size outbox rows, oldest first. Returns how many it did.
+    with transaction.atomic():
+        pending = ActivityOutbox.objects.order_by('id')
+        if connection.features.has_select_for_update_skip_locked:
+            # lets several workers run at once without picking up the same rows.
+            pending = pending.select_for_update(skip_locked=True)
+        pending = list(pending[:batch_size])
+        if not pending:
+            return 0
+
+        new_activity = [
+            Activity(action=item.action, datetime=item.datetime, user_id=item.user_id, project_id=item.project_id, location_id=item.location_id)
+            for item in pending
+        ]
+        if connection.features.can_return_rows_from_bulk_insert:
+            Activity.objects.bulk_create(new_activity)
+            new_ids = [activity.id for activity in new_activity]
+            created = Activity.objects.filter(id__in=new_ids)
+        else:
+            # SQLite doesn't give the new ids back, but it only allows one writer at a time, so everything after the current max id is ours.
+            last_id = Activity.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+            Activity.objects.bulk_create(new_activity)
+            created = Activity.objects.filter(id__gt=last_id)
+
+        created = list(ActivityFeedSerializer.setup_eager_loading(created).order_by('id'))
+        get_feed_backend().append(created)
+        publish_activity(created)
+        Project.objects.filter(pk__in={item.project_id for item in pending}).touch()
+
+        ActivityOutbox.objects.filter(id__in=[item.id for item in pending]).delete()
+
+    return len(pending)
@@ -0,0 +1,63 @@
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class CreloCursorPagination(CursorPagination):
+    # Keyset pagination: the cursor remembers the last ordering value it returned, so pages don't shift around when new rows are inserted and there's no COUNT(*) on the table.
+    # The ordering field needs an index (see the Meta.indexes on the models).
+    page_size_query_param = 'page_size'
+
+    def __init__(self, ordering='-date_created'):
+        if ordering.lstrip('-') == 'id':
+            self.ordering = (ordering,)
+        else:
+            # id breaks ties between rows with the same ordering value.
+            self.ordering = (ordering, '-id' if ordering.startswith('-') else 'id')
+        self.page_size = settings.PAGE_SIZE
+        self.max_page_size = settings.MAX_PAGE_SIZE
+
+
+class CreloLimitOffsetPagination(LimitOffsetPagination):
+    # Only for small tables where COUNT(*) is cheap (e.g. locations).
+    def __init__(self):
+        self.default_limit = settings.PAGE_SIZE
+        self.max_limit = settings.MAX_PAGE_SIZE
+
+
+class FeedPagination:
+    # For the pre-rendered location feeds (projects/feeds.py). They're not querysets so DRF's paginators don't work on them, but it's the same idea as the cursor pagination: ?before=<entry id> gives the page after that entry.
+    before_query_param = 'before'
+    page_size_query_param = 'page_size'
+
+    def paginate_feed(self, feed, location_id, request):
+        self.request = request
+        try:
+            before = request.query_params.get(self.before_query_param)
+            before = int(before) if before is not None else None
+            page_size = int(request.query_params.get(self.page_size_query_param, settings.PAGE_SIZE))
+        except ValueError:
+            raise ParseError("before and page_size need to be numbers.")
+        page_size = max(1, min(page_size, settings.MAX_PAGE_SIZE))
+
+        # ask for one extra entry to find out if there's another page.
+        entries = feed.read(location_id, before=before, limit=page_size + 1)
+        self.has_next = len(entries) > page_size
+        entries = entries[:page_size]
+        self.last_id = entries[-1][0] if entries else None
+        return [data for entry_id, data in entries]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.before_query_param, self.last_id)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
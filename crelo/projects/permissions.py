@@ -19,3 +19,14 @@ class IsAdminOrReadOnly(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
         return request.user.is_admin
+
+# for the exports, which aren't public even though they're GETs.
+class IsOwner(permissions.BasePermission):
+
+    def has_object_permission(self, request, view, obj):
+        return obj.user == request.user
+
+class IsAdmin(permissions.BasePermission):
+
+    def has_permission(self, request, view):
+        return getattr(request.user, 'is_admin', False)
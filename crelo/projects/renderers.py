@@ -0,0 +1,26 @@
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    # Same output as DRF's JSONRenderer (compact, UTF-8, datetimes as ISO 8601 with a Z), but encoded with orjson, which is
+    # several times faster on big lists. Falls back to JSONRenderer if orjson isn't installed or an indent was asked for
+    # (e.g. `Accept: application/json; indent=4`).
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # anything orjson doesn't know (lazy translations, decimals, ...) goes through DRF's encoder.
+        ret = orjson.dumps(data, default=encoders.JSONEncoder().default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+        # JSONRenderer escapes these two so the output is also valid javascript.
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+# for the list views that use projects/rows.py.
+FAST_RENDERER_CLASSES = [ORJSONRenderer, BrowsableAPIRenderer]
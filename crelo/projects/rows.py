@@ -0,0 +1,131 @@
+from django.utils.timezone import now
+
+
+# A faster way to output big lists for the read-only list views: read only the needed columns with .values(), then build the
+# plain dicts here instead of going through a DRF serializer field by field. Render them with renderers.ORJSONRenderer.
+#
+# Each *_rows() function must give exactly the same output as the serializer named in it (same keys, same order, same values),
+# ProjectRowsParityTests checks that. So if you change one of those serializers, change the matching function here too.
+
+def column(name):
+    return lambda project, current_time: project[name]
+
+
+def current_amount_pledged(project, current_time=None):
+    # same as Project.current_amount_pledged.
+    return project['current_amount'] if project['pledge_count'] else None
+
+
+def current_percentage_pledged(project, current_time=None):
+    # same as Project.current_percentage_pledged.
+    amount = current_amount_pledged(project)
+    return int(amount / project['goal_amount'] * 100) if amount else 0
+
+
+# ProjectSerializer's fields in order: the key in the row -> (the columns it's made from, how to make it).
+# ?fields= (projects/fieldsets.py) picks some of these, and only their columns are selected.
+PROJECT_FIELDS = {
+    'id': (('id',), column('id')),
+    'title': (('title',), column('title')),
+    'venue': (('venue',), column('venue')),
+    'description': (('description',), column('description')),
+    'pledgetype': (('pledgetype_id',), column('pledgetype_id')),
+    'goal_amount': (('goal_amount',), column('goal_amount')),
+    'image': (('image',), column('image')),
+    'is_open': (('due_date',), lambda project, current_time: project['due_date'] > current_time),
+    'date_created': (('date_created',), column('date_created')),
+    'user': (('user_id',), column('user_id')),
+    'due_date': (('due_date',), column('due_date')),
+    'category': (('category_id',), column('category_id')),
+    'location_id': (('user__location_id',), column('user__location_id')),
+    'last_milestone': (('last_milestone',), column('last_milestone')),
+    'last_chance_triggered': (('last_chance_triggered',), column('last_chance_triggered')),
+    'current_amount_pledged': (('current_amount', 'pledge_count'), current_amount_pledged),
+    'current_percentage_pledged': (('current_amount', 'pledge_count', 'goal_amount'), current_percentage_pledged),
+}
+
+# the project list views' cursor pagination orders by these, so they're always selected.
+PROJECT_ORDERING_COLUMNS = ('id', 'date_created', 'due_date')
+
+PLEDGE_VALUES = ('id', 'amount', 'comment', 'anonymous', 'user_id', 'project_id', 'date_created', 'project__pledgetype_id')
+
+ACTIVITY_VALUES = ('id', 'action', 'datetime', 'user_id', 'location_id', 'project_id')
+
+# the keys of the rows, e.g. for the CSV exports' header lines.
+PLEDGE_COLUMNS = ('id', 'amount', 'comment', 'anonymous', 'user', 'project_id', 'date_created', 'type_id')
+ACTIVITY_COLUMNS = ACTIVITY_VALUES
+
+
+def project_columns(fields=None):
+    columns = dict.fromkeys(PROJECT_ORDERING_COLUMNS)
+    for field in fields or PROJECT_FIELDS:
+        columns.update(dict.fromkeys(PROJECT_FIELDS[field][0]))
+    return tuple(columns)
+
+
+def project_values(queryset, fields=None):
+    # fields: the ?fields= the client asked for, None for all of them.
+    return queryset.values(*project_columns(fields))
+
+
+def project_rows(values, fields=None):
+    # ProjectSerializer
+    current_time = now()
+    if fields:
+        getters = [(field, PROJECT_FIELDS[field][1]) for field in fields]
+        return [{field: get(project, current_time) for field, get in getters} for project in values]
+
+    # all of them written out, which is over twice as fast as going through PROJECT_FIELDS for every key of every row.
+    rows = []
+    for project in values:
+        amount_pledged = current_amount_pledged(project)
+        rows.append({
+            'id': project['id'],
+            'title': project['title'],
+            'venue': project['venue'],
+            'description': project['description'],
+            'pledgetype': project['pledgetype_id'],
+            'goal_amount': project['goal_amount'],
+            'image': project['image'],
+            'is_open': project['due_date'] > current_time,
+            'date_created': project['date_created'],
+            'user': project['user_id'],
+            'due_date': project['due_date'],
+            'category': project['category_id'],
+            'location_id': project['user__location_id'],
+            'last_milestone': project['last_milestone'],
+            'last_chance_triggered': project['last_chance_triggered'],
+            'current_amount_pledged': amount_pledged,
+            'current_percentage_pledged': int(amount_pledged / project['goal_amount'] * 100) if amount_pledged else 0,
+        })
+    return rows
+
+
+def pledge_values(queryset):
+    return queryset.values(*PLEDGE_VALUES)
+
+
+def pledge_rows(values):
+    # PledgeSerializer
+    return [
+        {
+            'id': pledge['id'],
+            'amount': pledge['amount'],
+            'comment': pledge['comment'],
+            'anonymous': pledge['anonymous'],
+            'user': pledge['user_id'],
+            'project_id': pledge['project_id'],
+            'date_created': pledge['date_created'],
+            'type_id': pledge['project__pledgetype_id'],
+        }
+        for pledge in values
+    ]
+
+
+def activity_values(queryset):
+    return queryset.values(*ACTIVITY_VALUES)
+
+
+def activity_rows(values):
+    # ActivitySerializer - the values already have the right keys in the right order.
+    return [dict(activity) for activity in values]
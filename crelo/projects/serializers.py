@@ -1,15 +1,13 @@
 from rest_framework import serializers
 from .models import Project, Pledge, Pledgetype, ProjectCategory, Location, ProgressUpdate, Activity
+from .rows import PROJECT_FIELDS, project_columns
 
 # Importing this to check whether project has passed due date and should be closed.
 from django.utils.timezone import now
 from datetime import timedelta
 
-# Have to use signals in the serializers just for the milestone serializer method on ProjectSerializer.
-from django.dispatch import receiver, Signal
-
 # to calculate current amount pledged on Project serializer
-from django.db.models import Avg, Count, Min, Sum
+from django.db.models import Avg, Count, Min, Sum, Prefetch
 
 
 class ProjectCategorySerializer(serializers.Serializer):
@@ -40,15 +38,20 @@ class PledgetypeSerializer(serializers.Serializer):
 
 class PledgeSerializer(serializers.Serializer):
     id = serializers.ReadOnlyField()
-    amount = serializers.IntegerField()
+    amount = serializers.IntegerField(min_value=1)
     comment = serializers.CharField(max_length=200)
     anonymous = serializers.BooleanField()
     # The source argument (being passed in on the next line) controls which attribute is used to populate a field, and can point at any attribute on the serialized instance, which in this case the attribute is the id and the instance is the instance of a user.
-    user = serializers.ReadOnlyField(source='user.id')
-    project_id = serializers.ReadOnlyField(source='project.id')
+    user = serializers.ReadOnlyField(source='user_id')
+    project_id = serializers.ReadOnlyField()
     date_created = serializers.ReadOnlyField()
     # type_id = serializers.IntegerField()
-    type_id = serializers.ReadOnlyField(source='project.pledgetype.id')
+    type_id = serializers.ReadOnlyField(source='project.pledgetype_id')
+
+    # Reading the *_id columns instead of going through the related objects (user.id etc.) means no extra query per pledge. Only project still needs to be joined in.
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('project')
 
     def create(self, validated_data):
         return Pledge.objects.create(**validated_data)
@@ -69,10 +72,14 @@ class ActivitySerializer(serializers.Serializer):
     id = serializers.ReadOnlyField()
     action = serializers.CharField(max_length=200)
     datetime = serializers.ReadOnlyField()
-    user_id = serializers.ReadOnlyField(source='user.id')
-    location_id = serializers.ReadOnlyField(source='location.id')
-    project_id = serializers.ReadOnlyField(source='project.id')
-    
+    user_id = serializers.ReadOnlyField()
+    location_id = serializers.ReadOnlyField()
+    project_id = serializers.ReadOnlyField()
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset
+
     def create(self, validated_data):
         return Activity.objects.create(**validated_data)
 
@@ -101,10 +108,14 @@ class ActivitySerializer(serializers.Serializer):
 
 class ProgressUpdateSerializer(serializers.Serializer):
     id = serializers.ReadOnlyField()
-    project_id = serializers.ReadOnlyField(source='project.id')
+    project_id = serializers.ReadOnlyField()
     date_posted = serializers.ReadOnlyField()
     content = serializers.CharField(max_length=2000)
-    user = serializers.ReadOnlyField(source='project.user.id')
+    user = serializers.ReadOnlyField(source='project.user_id')
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('project')
 
     def create(self, validated_data):
         return ProgressUpdate.objects.create(**validated_data)
@@ -114,71 +125,49 @@ class ProgressUpdateSerializer(serializers.Serializer):
         instance.save()
         return instance
 
-# SIGNAL FUNCTIONS...
-
-activity_signal = Signal(providing_args=['action'])
+class SparseFieldsMixin:
+    # Pass fields=(...) / expand=(...) (see projects/fieldsets.py) and every other field is dropped before anything is serialized, so it's never computed.
+    # None keeps all of them.
+    expandable = ()
 
-@receiver(activity_signal)
-def activity_signal_receiver(sender, **kwargs):
-    print("activity signal was triggered. kwargs = ", kwargs)
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in list(self.fields):
+            if name in self.expandable:
+                keep = expand is None or name in expand
+            else:
+                keep = fields is None or name in fields
+            if not keep:
+                self.fields.pop(name)
 
-    activity_data = {"action": kwargs.get('action')}
-
-    activity_serializer = ActivitySerializer(data=activity_data)
-    if activity_serializer.is_valid():
-        print("activity serialize is valid!")
-        activity_serializer.save(
-            user=kwargs.get('user'), 
-            project=kwargs.get('project'),
-            location=kwargs.get('location')
-        )
 
 #this serializer shows just the project data
-class ProjectSerializer(serializers.Serializer):
+class ProjectSerializer(SparseFieldsMixin, serializers.Serializer):
     id = serializers.ReadOnlyField()
     title = serializers.CharField(max_length=200)
     venue = serializers.CharField(max_length=200, default="")
     description = serializers.CharField(max_length=800)
     pledgetype = serializers.PrimaryKeyRelatedField(queryset=Pledgetype.objects.all())
-    goal_amount = serializers.IntegerField()
+    goal_amount = serializers.IntegerField(min_value=1)
     image = serializers.URLField()
     is_open = serializers.ReadOnlyField()
     date_created = serializers.ReadOnlyField()
-    user = serializers.ReadOnlyField(source='user.id')
+    user = serializers.ReadOnlyField(source='user_id')
     due_date = serializers.DateTimeField()
     category = serializers.PrimaryKeyRelatedField(queryset=ProjectCategory.objects.all())
-    location_id = serializers.ReadOnlyField(source='user.location.id')
+    location_id = serializers.ReadOnlyField(source='user.location_id')
     last_milestone = serializers.IntegerField(default=0)
     last_chance_triggered = serializers.BooleanField(default=False)
     current_amount_pledged = serializers.ReadOnlyField()
     current_percentage_pledged = serializers.ReadOnlyField()
 
-    check_for_milestone = serializers.SerializerMethodField()
-    check_close_to_due_date = serializers.SerializerMethodField()
-
-    def get_check_close_to_due_date(self, instance):
-        if instance.is_open:
-            if instance.last_chance_triggered == False:
-                if instance.due_date - timedelta(days=5) < now():
-                    location = Location.objects.get(pk=instance.location_id)
-
-                    activity_signal.send(sender=Project, action="last-chance", user=instance.user, project=instance, location=location)
-
-                    instance.last_chance_triggered = True
-
-                    instance.save()
-
-    def get_check_for_milestone(self, instance):
-        if instance.is_open:
-            while instance.current_percentage_pledged > float(instance.last_milestone + 25):
-                instance.last_milestone += 25
+    # Every list view should pass its queryset through this before serializing, so a page of projects costs the same number of queries as a single project.
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('user')
 
-                location = Location.objects.get(pk=instance.location_id)
+    # NOTE: no side effects in here! Milestone activity is created when a pledge is saved (Project.check_for_milestone) and last-chance activity by the send_last_chance_activity command.
 
-                activity_signal.send(sender=Project, action=f"milestone-{instance.last_milestone}", user=instance.user, project=instance, location=location)
-
-                instance.save()
-        
     # this func is required to store the data sent in the POST request to the database..
     def create(self, validated_data):
         # the "**"" unpacks the validated_Data
@@ -196,7 +185,9 @@ class ProjectSerializer(serializers.Serializer):
         instance.due_date = validated_data.get('due_date', instance.due_date)
         instance.category_id = validated_data.get('category_id', instance.category_id)
         # instance.location_id = validated_data.get('location_id', instance.location_id)
-        instance.save()
+        # only the editable fields, a plain save() would write back the pledge totals, last_milestone and version as they were when
+        # the project was loaded and lose any pledges made since.
+        instance.save(update_fields=['title', 'description', 'goal_amount', 'image', 'due_date', 'category_id'])
         return instance
 
     def get_check_is_open(self, instance):
@@ -214,25 +205,63 @@ class ProjectDetailSerializer(ProjectSerializer):
 
     pledges = serializers.SerializerMethodField()
 
+    expandable = ('updates', 'project_activity', 'pledges')
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None, expand=None):
+        # only what the requested fields and expansions need: no join on the user without location_id, and no prefetch for a list that isn't embedded.
+        if fields is not None:
+            # the embedded updates and pledges read their project's user_id / pledgetype_id.
+            queryset = queryset.only(*project_columns(fields), 'user_id', 'pledgetype_id')
+        if fields is None or 'location_id' in fields:
+            queryset = queryset.select_related('user')
+
+        prefetches = {
+            'updates': 'updates',
+            'project_activity': 'project_activity',
+            'pledges': Prefetch('pledges', queryset=Pledge.objects.order_by('-amount', '-date_created'), to_attr='ordered_pledges'),
+        }
+        return queryset.prefetch_related(*[
+            prefetch for name, prefetch in prefetches.items() if expand is None or name in expand
+        ])
+
     def get_pledges(self, instance):
-         ordered_queryset = instance.pledges.all().order_by('-amount','-date_created')
-         return PledgeSerializer(ordered_queryset, many=True, context=self.context).data
+        ordered_pledges = getattr(instance, 'ordered_pledges', None)
+        if ordered_pledges is None:
+            ordered_pledges = instance.pledges.all().order_by('-amount','-date_created')
+        return PledgeSerializer(ordered_pledges, many=True, context=self.context).data
 
 
 class ActivityDetailSerializer(ActivitySerializer):
     project = ProjectSerializer(read_only=True)
 
+    # prefetch rather than join, so each project (and its user) on a page is only fetched once however many activities point at it.
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.prefetch_related('project__user')
+
+
+class ActivityProjectSerializer(serializers.Serializer):
+    id = serializers.ReadOnlyField()
+    title = serializers.ReadOnlyField()
+
+
+class ActivityFeedSerializer(ActivitySerializer):
+    # what's stored in the location feeds and sent to the event streams. Entries are rendered once and kept, so only the parts of
+    # the project that don't go stale (pledge totals, is_open etc. do) - clients fetch the project itself for the rest.
+    project = ActivityProjectSerializer(read_only=True)
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.prefetch_related(Prefetch('project', queryset=Project.objects.only('id', 'title')))
+
 
 class LocationSerializer(serializers.Serializer):
     id = serializers.ReadOnlyField()
     name = serializers.CharField(max_length=200)
     # slug_name = serializers.CharField(max_length=50)
 
-    activity = serializers.SerializerMethodField()
-
-    def get_activity(self, instance):
-         ordered_queryset = instance.location_activity.all().order_by('-datetime')
-         return ActivityDetailSerializer(ordered_queryset, many=True, context=self.context).data
+    # activity isn't embedded here, it's served page by page from /locations/<pk>/activity/ (LocationActivity).
 
     def create(self, validated_data):
         return Location.objects.create(**validated_data)
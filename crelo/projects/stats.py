@@ -0,0 +1,112 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.utils.timezone import now
+
+from .models import LocationCategoryStats, Project
+
+
+# LocationCategoryStats: the open projects' totals for each (location, category), so /locations/<pk>/stats/ is a couple of
+# small indexed reads instead of going through every project.
+#
+# The views add to / take away from the totals with F() updates as projects and pledges are written (the same way as
+# Project.current_amount). A project stays counted while Project.counted_open is True. Projects don't write anything when
+# they reach their due date, so close_due_projects() (the close_due_projects command, run on a schedule) takes them out
+# afterwards, and LocationStats leaves out the ones it hasn't got to yet. rebuild_location_stats recomputes the lot.
+
+STATS_COLUMNS = ('open_project_count', 'total_goal', 'total_pledged', 'pledge_count')
+
+
+def adjust_stats(location_id, category_id, open_project_count=0, total_goal=0, total_pledged=0, pledge_count=0):
+    changes = {
+        'open_project_count': open_project_count,
+        'total_goal': total_goal,
+        'total_pledged': total_pledged,
+        'pledge_count': pledge_count,
+    }
+    rows = LocationCategoryStats.objects.filter(location_id=location_id, category_id=category_id)
+    if rows.update(**{column: F(column) + change for column, change in changes.items()}):
+        return
+    try:
+        # the first project in this location and category. In a savepoint, so losing the race with another process doesn't break the caller's transaction.
+        with transaction.atomic():
+            LocationCategoryStats.objects.create(location_id=location_id, category_id=category_id, **changes)
+    except IntegrityError:
+        rows.update(**{column: F(column) + change for column, change in changes.items()})
+
+
+def project_totals(project, sign=1):
+    # what one open project adds to its row.
+    return {
+        'open_project_count': sign,
+        'total_goal': sign * project.goal_amount,
+        'total_pledged': sign * project.current_amount,
+        'pledge_count': sign * project.pledge_count,
+    }
+
+
+def add_project(project):
+    adjust_stats(project.location_id, project.category_id, **project_totals(project))
+
+
+def remove_project(project):
+    adjust_stats(project.location_id, project.category_id, **project_totals(project, sign=-1))
+
+
+def close_due_projects():
+    # takes the projects that have reached their due date out of the open totals. One query on the (counted_open, due_date) index.
+    closed = 0
+    with transaction.atomic():
+        projects = Project.objects.select_for_update().filter(counted_open=True, due_date__lte=now()).only(
+            'id', 'location_id', 'category_id', 'goal_amount', 'current_amount', 'pledge_count'
+        )
+        for project in projects:
+            remove_project(project)
+            closed += 1
+        Project.objects.filter(pk__in=[project.id for project in projects]).update(counted_open=False)
+    return closed
+
+
+def location_stats(location_id):
+    # the location's rows, less any projects that have closed since close_due_projects last ran.
+    totals = {
+        row['category_id']: row
+        for row in LocationCategoryStats.objects.filter(location_id=location_id).values('category_id', *STATS_COLUMNS)
+    }
+    # only the projects that closed since close_due_projects last ran, so a handful at most.
+    overdue = Project.objects.filter(location_id=location_id, counted_open=True, due_date__lte=now()).only(
+        'category_id', 'goal_amount', 'current_amount', 'pledge_count'
+    )
+    for project in overdue:
+        category = totals.get(project.category_id)
+        if category is not None:
+            for column, change in project_totals(project, sign=-1).items():
+                category[column] += change
+
+    categories = [
+        {'category': category_id, **{column: row[column] for column in STATS_COLUMNS}}
+        for category_id, row in sorted(totals.items())
+        if row['open_project_count']
+    ]
+    return {
+        'location': location_id,
+        **{column: sum(category[column] for category in categories) for column in STATS_COLUMNS},
+        'categories': categories,
+    }
+
+
+def rebuild_location_stats():
+    # recalculates every row in one GROUP BY over the open projects. Returns the number of rows.
+    current_time = now()
+    with transaction.atomic():
+        totals = Project.objects.filter(due_date__gt=current_time).values('location_id', 'category_id').annotate(
+            open_project_count=Count('id'),
+            total_goal=Sum('goal_amount'),
+            total_pledged=Sum('current_amount'),
+            pledge_count=Sum('pledge_count'),
+        ).order_by()
+        rows = [LocationCategoryStats(**row) for row in totals]
+        LocationCategoryStats.objects.all().delete()
+        LocationCategoryStats.objects.bulk_create(rows)
+        Project.objects.filter(due_date__gt=current_time).exclude(counted_open=True).update(counted_open=True)
+        Project.objects.filter(due_date__lte=current_time).exclude(counted_open=False).update(counted_open=False)
+    return len(rows)
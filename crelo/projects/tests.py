@@ -1,3 +1,1010 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+import asyncio
+import fcntl
+import json
+import os
+import re
+import tempfile
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import urlencode
+from django.utils.timezone import now
+from asgiref.sync import async_to_sync, sync_to_async
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from crelo import metrics, profiling, sse
+from crelo.sse import EventStreamApplication
+from crelo.routers import PrimaryReplicaRouter, ReplicaPinningMiddleware
+from crelo.sqlite.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from users.authentication import token_cache
+from users.models import CustomUser
+from .models import Project, ProjectCategory, Location, Pledgetype, Pledge, ProgressUpdate, Activity, ActivityOutbox
+from .events import LocalBroker, RedisBroker, get_broker
+from .feeds import DatabaseFeedBackend, LocMemFeedBackend
+from .outbox import process_outbox
+from .renderers import ORJSONRenderer
+from .rows import PROJECT_FIELDS, project_values, project_rows, pledge_values, pledge_rows, activity_values, activity_rows
+from .serializers import ProjectSerializer, ProjectDetailSerializer, PledgeSerializer, ActivitySerializer
+from .views import LocationList, PledgeDetail
+
+
+def create_project(user, category, pledgetype, title="Test project", due_in_days=30):
+    return Project.objects.create(
+        title=title,
+        description="Test project",
+        goal_amount=1000,
+        image="https://example.com/image.png",
+        due_date=now() + timedelta(days=due_in_days),
+        user=user,
+        category=category,
+        location=user.location,
+        pledgetype=pledgetype
+    )
+
+
+class QueryBudgetMixin:
+    # assertQueryBudget fails if a GET takes more queries than its budget. The test data has several rows per table, so an N+1 in a serializer blows the budget straight away.
+
+    def assertQueryBudget(self, url, budget, client=None):
+        client = client or self.client
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        sql = "\n".join(query['sql'] for query in queries.captured_queries)
+        self.assertLessEqual(len(queries), budget, f"GET {url} took {len(queries)} queries (budget {budget}):\n{sql}")
+        return response
+
+
+class QueryPlanMixin:
+    # assertIndexedPlan runs EXPLAIN on every SELECT a GET makes, and fails if the database would read a whole table (that isn't in allow_scan) or sort the rows itself instead of reading them in index order.
+    # SQLite: EXPLAIN QUERY PLAN, looking for "SCAN <table>" without an index and "USE TEMP B-TREE".
+    # Postgres: EXPLAIN with sequential scans turned off (the tables are tiny in tests, so it would pick them anyway), looking for "Seq Scan" and "Sort".
+
+    sqlite_full_scan = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+    postgres_full_scan = re.compile(r'Seq Scan on (\w+)')
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+                return [row[-1] for row in cursor.fetchall()]
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute(f"EXPLAIN {sql}")
+            return [row[0] for row in cursor.fetchall()]
+
+    def plan_problems(self, plan, allow_scan):
+        problems = []
+        for line in plan:
+            if connection.vendor == 'sqlite':
+                full_scan = self.sqlite_full_scan.match(line.strip())
+                sort = 'USE TEMP B-TREE' in line
+            else:
+                full_scan = self.postgres_full_scan.search(line)
+                sort = re.search(r'\bSort\b', line) and 'Sort Key' not in line
+            if full_scan and full_scan.group(1) not in allow_scan:
+                problems.append(line.strip())
+            if sort:
+                problems.append(line.strip())
+        return problems
+
+    def assertIndexedPlan(self, url, allow_scan=(), client=None):
+        client = client or self.client
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            plan = self.explain(sql)
+            problems = self.plan_problems(plan, allow_scan)
+            self.assertFalse(problems, f"GET {url} ran a query without a usable index:\n{sql}\n" + "\n".join(plan))
+        return response
+
+
+class ProjectListFilteredBenchmark(TestCase):
+    # The favourites list should cost the same whether a user has 1 or 50 favourite categories.
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.location = Location.objects.create(name="South Perth")
+        cls.pledgetype = Pledgetype.objects.create(type="money")
+        cls.categories = [ProjectCategory.objects.create(name=f"Category {i}") for i in range(50)]
+        cls.owner = CustomUser.objects.create(username="owner", location=cls.location)
+
+        # only the first category has projects, so every run returns the same rows.
+        for i in range(5):
+            create_project(cls.owner, cls.categories[0], cls.pledgetype, title=f"Project {i}")
+
+    def run_favourites(self, favourite_count):
+        user = CustomUser.objects.create(username=f"fan-{favourite_count}", location=self.location)
+        user.favourite_categories.set(self.categories[:favourite_count])
+
+        client = APIClient()
+        client.force_authenticate(user)
+        url = f'/locations/{self.location.id}/categories/favourites/'
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        query_count = len(queries)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 5)
+        return query_count
+
+    def test_query_count_is_flat(self):
+        # timings live in the bench command, this only checks the query count doesn't grow.
+        query_counts = {self.run_favourites(count) for count in (1, 10, 50)}
+        self.assertEqual(len(query_counts), 1)
+
+
+class EndpointTestCase(TestCase):
+    # A few rows in every table, shared by the query budget and query plan tests.
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.location = Location.objects.create(name="South Perth")
+        cls.category = ProjectCategory.objects.create(name="Arts")
+        cls.pledgetype = Pledgetype.objects.create(type="money")
+        cls.users = [CustomUser.objects.create(username=f"user-{i}", location=cls.location) for i in range(5)]
+        for user in cls.users:
+            user.favourite_categories.add(cls.category)
+
+        cls.projects = [create_project(user, cls.category, cls.pledgetype, title=f"Project {i}") for i, user in enumerate(cls.users)]
+        for project in cls.projects:
+            for user in cls.users:
+                Pledge.objects.create(amount=10, comment="Go!", anonymous=False, project=project, user=user, type=cls.pledgetype)
+                Activity.objects.create(action="milestone-25", user=user, project=project, location=cls.location)
+            for i in range(3):
+                ProgressUpdate.objects.create(project=project, content=f"Update {i}")
+
+        cls.project = cls.projects[0]
+        call_command('rebuild_activity_feed', stdout=StringIO())
+
+    def setUp(self):
+        # measure the uncached responses.
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+
+class QueryBudgetTests(QueryBudgetMixin, EndpointTestCase):
+
+    def test_project_list(self):
+        self.assertQueryBudget('/projects/', 1)
+
+    def test_project_detail(self):
+        # + 1 for the ETag's version lookup.
+        self.assertQueryBudget(f'/projects/{self.project.id}/', 5)
+
+    def test_pledge_list(self):
+        self.assertQueryBudget(f'/projects/{self.project.id}/pledges/', 2)
+
+    def test_progress_update_list(self):
+        self.assertQueryBudget(f'/projects/{self.project.id}/progress-updates/', 1)
+
+    def test_activity_list(self):
+        self.assertQueryBudget('/activities/', 1)
+
+    def test_location_list(self):
+        self.assertQueryBudget('/locations/', 2)
+
+    def test_location_detail(self):
+        self.assertQueryBudget(f'/locations/{self.location.id}/', 1)
+
+    def test_location_activity(self):
+        self.assertQueryBudget(f'/locations/{self.location.id}/activity/', 1)
+
+    def test_projects_by_location(self):
+        self.assertQueryBudget(f'/locations/{self.location.id}/categories/', 1)
+
+    def test_projects_by_location_and_category(self):
+        self.assertQueryBudget(f'/locations/{self.location.id}/categories/{self.category.id}/', 1)
+
+    def test_favourite_projects(self):
+        self.assertQueryBudget(f'/locations/{self.location.id}/categories/favourites/', 1)
+
+    def test_reference_lists(self):
+        self.assertQueryBudget('/pledges/types/', 1)
+        self.assertQueryBudget('/project-categories/', 1)
+
+
+class LocationFeedTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.location = Location.objects.create(name="South Perth")
+        cls.user = CustomUser.objects.create(username="owner", location=cls.location)
+        cls.project = create_project(cls.user, ProjectCategory.objects.create(name="Arts"), Pledgetype.objects.create(type="money"))
+        cls.activity = [
+            Activity.objects.create(action=f"milestone-{i}", user=cls.user, project=cls.project, location=cls.location)
+            for i in range(5)
+        ]
+
+    def check_backend(self, feed):
+        for activity in self.activity:
+            feed.append([activity])
+
+        # only the newest 3 are kept, newest first.
+        entries = feed.read(self.location.id, limit=10)
+        self.assertEqual([data['action'] for entry_id, data in entries], ["milestone-4", "milestone-3", "milestone-2"])
+        # only what can't go stale, the project's totals are fetched from the project itself.
+        self.assertEqual(entries[0][1]['project'], {'id': self.project.id, 'title': self.project.title})
+
+        older = feed.read(self.location.id, before=entries[0][0], limit=10)
+        self.assertEqual([data['action'] for entry_id, data in older], ["milestone-3", "milestone-2"])
+
+    def test_database_backend(self):
+        self.check_backend(DatabaseFeedBackend(size=3))
+
+    def test_locmem_backend(self):
+        self.check_backend(LocMemFeedBackend(size=3))
+
+    def test_location_activity_pages(self):
+        DatabaseFeedBackend(size=10).append(self.activity)
+
+        response = APIClient().get(f'/locations/{self.location.id}/activity/?page_size=3')
+        self.assertEqual([item['action'] for item in response.data['results']], ["milestone-4", "milestone-3", "milestone-2"])
+
+        response = APIClient().get(response.data['next'])
+        self.assertEqual([item['action'] for item in response.data['results']], ["milestone-1", "milestone-0"])
+        self.assertIsNone(response.data['next'])
+
+
+class ResponseCacheTests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.location = Location.objects.create(name="South Perth")
+        cls.admin = CustomUser.objects.create(username="admin", location=cls.location, is_admin=True)
+        ProjectCategory.objects.create(name="Arts")
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_second_request_is_cached(self):
+        first = self.client.get('/project-categories/')
+        second = self.assertQueryBudget('/project-categories/', 0)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_write_invalidates(self):
+        self.client.get('/project-categories/')
+
+        self.client.force_authenticate(self.admin)
+        self.client.post('/project-categories/', {'name': "Kids"}, format='json')
+
+        response = self.client.get('/project-categories/')
+        self.assertEqual([category['name'] for category in response.data], ["Arts", "Kids"])
+
+    def test_if_none_match(self):
+        etag = self.client.get(f'/locations/{self.location.id}/')['ETag']
+
+        response = self.client.get(f'/locations/{self.location.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.location.name = "Como"
+        self.location.save()
+        response = self.client.get(f'/locations/{self.location.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], "Como")
+
+
+class ConditionalGetTests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.location = Location.objects.create(name="South Perth")
+        cls.user = CustomUser.objects.create(username="owner", location=cls.location)
+        cls.project = create_project(cls.user, ProjectCategory.objects.create(name="Arts"), Pledgetype.objects.create(type="money"))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_unchanged_project_is_not_modified(self):
+        for url in (f'/projects/{self.project.id}/', f'/projects/{self.project.id}/pledges/'):
+            etag = self.client.get(url)['ETag']
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(len(queries), 1)
+
+    def test_new_pledge_changes_etag(self):
+        url = f'/projects/{self.project.id}/'
+        etag = self.client.get(url)['ETag']
+
+        self.client.post(f'/projects/{self.project.id}/pledges/', {'amount': 50, 'comment': "Go!", 'anonymous': False}, format='json')
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['current_amount_pledged'], 50)
+
+    def test_closing_changes_etag(self):
+        url = f'/projects/{self.project.id}/'
+        etag = self.client.get(url)['ETag']
+
+        # the due date passing doesn't save the project.
+        Project.objects.filter(pk=self.project.id).update(due_date=now() - timedelta(minutes=1))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['is_open'])
+
+
+class ProjectTotalsTests(TestCase):
+    # the pledge totals are counters on the project, they mustn't be written back from an old copy or taken off twice.
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.location = Location.objects.create(name="South Perth")
+        cls.user = CustomUser.objects.create(username="owner", location=cls.location)
+        cls.project = create_project(cls.user, ProjectCategory.objects.create(name="Arts"), Pledgetype.objects.create(type="money"))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_edit_keeps_pledges_made_since(self):
+        loaded = Project.objects.get(pk=self.project.id)
+        # a pledge lands after the project was loaded for the edit.
+        Project.objects.filter(pk=self.project.id).update(current_amount=50, pledge_count=1, last_milestone=25, version=7)
+
+        serializer = ProjectDetailSerializer(loaded, data={'title': "Renamed"}, partial=True)
+        self.assertTrue(serializer.is_valid())
+        serializer.save()
+
+        project = Project.objects.get(pk=self.project.id)
+        self.assertEqual(project.title, "Renamed")
+        self.assertEqual((project.current_amount, project.pledge_count, project.last_milestone, project.version), (50, 1, 25, 7))
+
+    def test_pledge_is_only_taken_off_once(self):
+        response = self.client.post(f'/projects/{self.project.id}/pledges/', {'amount': 50, 'comment': "Go!", 'anonymous': False}, format='json')
+        url = f"/projects/{self.project.id}/pledges/{response.data['id']}/"
+        pledge = Pledge.objects.get(pk=response.data['id'])
+
+        # another DELETE of the same pledge gets in between this one loading it and deleting it.
+        with mock.patch.object(PledgeDetail, 'get_object', return_value=pledge):
+            self.assertEqual(self.client.delete(url).status_code, 204)
+            self.assertEqual(self.client.delete(url).status_code, 404)
+
+        project = Project.objects.get(pk=self.project.id)
+        self.assertEqual((project.current_amount, project.pledge_count), (0, 0))
+        self.assertEqual(CustomUser.objects.get(pk=self.user.id).pledge_count, 0)
+
+
+class RequestMetricsTests(EndpointTestCase):
+
+    def setUp(self):
+        super().setUp()
+        metrics.store.histograms.clear()
+        metrics.store.requests.clear()
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/projects/{self.project.id}/')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="%d queries", serialize;dur=[\d.]+, total;dur=[\d.]+$' % len(queries))
+
+    def test_metrics_endpoint(self):
+        self.client.get('/projects/')
+        self.client.get('/projects/')
+
+        # not an admin, and no token.
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+        with override_settings(METRICS={**settings.METRICS, 'TOKEN': 'secret'}):
+            response = APIClient().get('/metrics', HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('crelo_requests_total{view="ProjectList",method="GET",status="200"} 2', text)
+        self.assertIn('crelo_db_queries_bucket{view="ProjectList",method="GET",le="1"} 2', text)
+        self.assertIn('crelo_request_duration_seconds_count{view="ProjectList",method="GET"} 2', text)
+
+    def test_metrics_are_combined_across_processes(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS={**settings.METRICS, 'DIR': directory}):
+            self.client.get('/projects/')
+            metrics.store.flush(directory)
+            # pretend another worker wrote the same file.
+            os.rename(os.path.join(directory, f"metrics-{os.getpid()}.json"), os.path.join(directory, "metrics-1.json"))
+            self.client.get('/projects/')
+
+            histograms, requests = metrics.store.combined()
+        self.assertEqual(requests[('ProjectList', 'GET', '200')], 3)
+        self.assertEqual(histograms[('crelo_db_queries', 'ProjectList', 'GET')]['count'], 3)
+
+
+class ProfilingTests(EndpointTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.profiling = override_settings(PROFILING={**settings.PROFILING, 'DIR': self.directory.name, 'MAX_FILES': 2})
+        self.profiling.enable()
+        self.addCleanup(self.profiling.disable)
+
+    def token_client(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=user).key}")
+        return client
+
+    def test_admins_can_profile_requests(self):
+        admin = CustomUser.objects.create(username="admin", location=self.location, is_admin=True)
+        client = self.token_client(admin)
+        for _ in range(3):
+            response = client.get(f'/projects/{self.project.id}/?profile=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['X-Profile-File'], r'-ProjectDetail-GET\.prof$')
+        # only the newest MAX_FILES are kept.
+        self.assertEqual(len(os.listdir(self.directory.name)), 2)
+        self.assertNotIn('X-Profile-File', client.get(f'/projects/{self.project.id}/'))
+
+    def test_other_users_cant(self):
+        response = self.token_client(self.users[1]).get(f'/projects/{self.project.id}/', HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-File', response)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    @override_settings(SLOW_QUERIES={'THRESHOLD_MS': 0, 'EXPLAIN': True, 'LOG_PARAMS': False})
+    def test_slow_query_log(self):
+        secret = "secret title"
+        with self.assertLogs('crelo.slow_queries', level='WARNING') as logs:
+            Project.objects.filter(title=secret).count()
+        self.assertIn('FROM "projects_project"', logs.output[0])
+        self.assertIn('projects/tests.py', logs.output[0])
+        self.assertIn('plan:', logs.output[0])
+        self.assertIn('params: (1 hidden', logs.output[0])
+        self.assertNotIn('secret title', logs.output[0])
+
+    def test_failed_explain_only_rolls_back_its_savepoint(self):
+        # a TestCase runs inside a transaction, like a request with ATOMIC_REQUESTS or an atomic() block.
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIn("EXPLAIN failed", profiling.explain(connection, 'SELECT * FROM "nowhere"', ()))
+        self.assertTrue(any(query['sql'].startswith('ROLLBACK TO SAVEPOINT') for query in queries.captured_queries))
+        self.assertTrue(Project.objects.filter(pk=self.project.id).exists())
+
+    @override_settings(SLOW_QUERIES={'THRESHOLD_MS': 0, 'EXPLAIN': False, 'LOG_PARAMS': True})
+    def test_slow_query_log_params(self):
+        with self.assertLogs('crelo.slow_queries', level='WARNING') as logs:
+            Project.objects.filter(title="secret title").count()
+        self.assertIn("params: ('secret title',)", logs.output[0])
+
+
+class ProjectRowsParityTests(EndpointTestCase):
+    # projects/rows.py + ORJSONRenderer have to give byte for byte the same JSON as the serializers + JSONRenderer.
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # no pledges, a percentage that float maths gets wrong (29 / 100 * 100 = 28.999...), a closed project,
+        # a due date without microseconds and characters JSONRenderer escapes.
+        create_project(cls.users[1], cls.category, cls.pledgetype, title="Nothing pledged yet \u2028 \u00e9")
+        odd = create_project(cls.users[2], cls.category, cls.pledgetype, title="Odd percentage")
+        Project.objects.filter(pk=odd.pk).update(goal_amount=100, current_amount=29, pledge_count=1)
+        closed = create_project(cls.users[3], cls.category, cls.pledgetype, title="Closed", due_in_days=-3)
+        Project.objects.filter(pk=closed.pk).update(due_date=closed.due_date.replace(microsecond=0))
+
+    def assertSameJSON(self, serializer_data, rows):
+        self.assertEqual(ORJSONRenderer().render(rows), JSONRenderer().render(serializer_data))
+
+    def test_projects(self):
+        projects = Project.objects.order_by('id')
+        self.assertSameJSON(ProjectSerializer(projects, many=True).data, project_rows(project_values(projects)))
+
+    def test_pledges(self):
+        pledges = Pledge.objects.order_by('id')
+        self.assertSameJSON(PledgeSerializer(pledges, many=True).data, pledge_rows(pledge_values(pledges)))
+
+    def test_activity(self):
+        activity = Activity.objects.order_by('id')
+        self.assertSameJSON(ActivitySerializer(activity, many=True).data, activity_rows(activity_values(activity)))
+
+    def test_list_endpoint(self):
+        response = self.client.get('/projects/', HTTP_ACCEPT='application/json')
+        projects = Project.objects.order_by('-date_created', '-id')[:settings.PAGE_SIZE]
+        expected = {'next': response.json()['next'], 'previous': None, 'results': ProjectSerializer(projects, many=True).data}
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+
+
+class SparseFieldsetTests(QueryBudgetMixin, EndpointTestCase):
+
+    def test_list_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/projects/?fields=current_percentage_pledged,title,id,image&page_size=2')
+        self.assertEqual(list(response.json()['results'][0]), ['id', 'title', 'image', 'current_percentage_pledged'])
+        # only the columns those need (and the ordering), no description and no join on the user for location_id.
+        self.assertNotIn('description', queries[0]['sql'])
+        self.assertNotIn('users_customuser', queries[0]['sql'])
+
+        # the next page still works without date_created in the output.
+        response = self.client.get(response.json()['next'])
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_sparse_rows_match_full_rows(self):
+        projects = Project.objects.order_by('id')
+        fields = ('id', 'is_open', 'location_id', 'current_amount_pledged', 'current_percentage_pledged')
+        full = project_rows(project_values(projects))
+        self.assertEqual(project_rows(project_values(projects, fields), fields), [{field: row[field] for field in fields} for row in full])
+        self.assertEqual(project_rows(project_values(projects), tuple(PROJECT_FIELDS)), full)
+
+    def test_detail_fields_and_expand(self):
+        url = f'/projects/{self.project.id}/'
+        # ETag lookup + the project, no prefetches.
+        response = self.assertQueryBudget(f'{url}?fields=id,title&expand=', 2)
+        self.assertEqual(response.data, {'id': self.project.id, 'title': self.project.title})
+
+        response = self.assertQueryBudget(f'{url}?fields=id,location_id&expand=pledges,updates', 4)
+        self.assertEqual(set(response.data), {'id', 'location_id', 'pledges', 'updates'})
+        self.assertEqual(response.data['location_id'], self.location.id)
+        self.assertEqual(response.data['pledges'][0]['type_id'], self.pledgetype.id)
+        self.assertEqual(response.data['updates'][0]['user'], self.project.user_id)
+
+        # without either, everything as before.
+        response = self.client.get(url)
+        self.assertEqual(response.data, ProjectDetailSerializer(self.project).data)
+
+    def test_different_fields_have_different_etags(self):
+        url = f'/projects/{self.project.id}/'
+        self.assertNotEqual(self.client.get(url)['ETag'], self.client.get(f'{url}?fields=id')['ETag'])
+        # the same fields asked for differently are the same content.
+        self.assertEqual(self.client.get(f'{url}?fields=title,id')['ETag'], self.client.get(f'{url}?fields=id,title,&other=1')['ETag'])
+
+    def test_bad_fields_have_no_etag(self):
+        response = self.client.get(f'/projects/{self.project.id}/?fields=secret')
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('ETag', response)
+
+    def test_unknown_field(self):
+        self.assertEqual(self.client.get('/projects/?fields=id,secret').status_code, 400)
+        self.assertEqual(self.client.get(f'/projects/{self.project.id}/?expand=user').status_code, 400)
+
+
+class BatchTests(QueryBudgetMixin, EndpointTestCase):
+
+    def test_projects_by_ids(self):
+        ids = [self.projects[3].id, self.projects[1].id, 0, self.projects[3].id]
+        # the projects (with their users) + updates, activity and pledges, however many ids.
+        response = self.assertQueryBudget(f"/projects/?ids={','.join(map(str, ids))}", 4)
+        results = response.json()['results']
+        self.assertEqual([project['id'] for project in results], [self.projects[3].id, self.projects[1].id])
+        self.assertEqual(results[1], self.client.get(f'/projects/{self.projects[1].id}/').json())
+
+        response = self.assertQueryBudget(f'/projects/?ids={self.project.id}&fields=id,title&expand=', 1)
+        self.assertEqual(response.json()['results'], [{'id': self.project.id, 'title': self.project.title}])
+
+        self.assertEqual(self.client.get('/projects/?ids=1,two').status_code, 400)
+
+    def batch(self, *urls, client=None):
+        response = (client or self.client).get(f"/batch/?{urlencode([('request', url) for url in urls])}")
+        self.assertEqual(response.status_code, 200)
+        return response.json()['responses']
+
+    def test_batch(self):
+        responses = self.batch(
+            f'/locations/{self.location.id}/',
+            f'/locations/{self.location.id}/categories/?fields=id',
+            '/project-categories/',
+            f'/projects/?ids={self.project.id}',
+            '/account/',
+        )
+        self.assertEqual([response['status'] for response in responses], [200] * 5)
+        self.assertEqual(responses[0]['body'], self.client.get(f'/locations/{self.location.id}/').json())
+        self.assertEqual(responses[1]['body']['results'][0], {'id': self.project.id})
+        self.assertEqual(responses[4]['body']['user']['id'], self.users[0].id)
+
+    def test_batch_authenticates_once(self):
+        token_cache.clear()
+        token = Token.objects.create(user=self.users[0])
+        client = APIClient(HTTP_AUTHORIZATION=f"Token {token.key}")
+        with CaptureQueriesContext(connection) as queries:
+            responses = self.batch('/account/', '/account/pledges/', client=client)
+        self.assertEqual([response['status'] for response in responses], [200, 200])
+        self.assertEqual(sum('authtoken_token' in query['sql'] for query in queries.captured_queries), 1)
+
+    def test_batch_errors(self):
+        client = APIClient()
+        responses = self.batch('/account/', '/nowhere/', '/metrics', f'/projects/{self.project.id}/pledges/', client=client)
+        # each view checks its own permissions.
+        self.assertEqual([response['status'] for response in responses], [404, 404, 404, 200])
+
+        # GETs that write, and the exports, aren't batched.
+        category = ProjectCategory.objects.create(name="Gardening")
+        responses = self.batch(f'/account/add-category/{category.id}/', '/activities/export.csv')
+        self.assertEqual([response['status'] for response in responses], [400, 400])
+        self.assertFalse(self.users[0].favourite_categories.filter(pk=category.id).exists())
+
+        # one sub-request blowing up doesn't take the others with it.
+        with mock.patch.object(LocationList, 'get', side_effect=RuntimeError("boom")), self.assertLogs('crelo.batch', level='ERROR'):
+            responses = self.batch('/locations/', '/project-categories/')
+        self.assertEqual([response['status'] for response in responses], [500, 200])
+
+        self.assertEqual(self.client.get('/batch/').status_code, 400)
+        with override_settings(BATCH_MAX_REQUESTS=2):
+            self.assertEqual(self.client.get(f"/batch/?{urlencode([('request', '/locations/')] * 3)}").status_code, 400)
+
+
+class LocationStatsTests(QueryBudgetMixin, QueryPlanMixin, EndpointTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # the fixtures are made straight through the ORM.
+        call_command('rebuild_pledge_totals', stdout=StringIO())
+        call_command('rebuild_location_stats', stdout=StringIO())
+
+    def stats(self):
+        response = self.assertQueryBudget(f'/locations/{self.location.id}/stats/', 3)
+        return response.data
+
+    def assertMatchesRebuild(self):
+        before = self.stats()
+        call_command('rebuild_location_stats', stdout=StringIO())
+        self.assertEqual(before, self.stats())
+
+    def test_stats(self):
+        self.assertEqual(self.stats(), {
+            'location': self.location.id, 'open_project_count': 5, 'total_goal': 5000, 'total_pledged': 250, 'pledge_count': 25,
+            'categories': [{'category': self.category.id, 'open_project_count': 5, 'total_goal': 5000, 'total_pledged': 250, 'pledge_count': 25}],
+        })
+        self.assertIndexedPlan(f'/locations/{self.location.id}/stats/')
+        self.assertEqual(self.client.get('/locations/0/stats/').status_code, 404)
+
+    def test_writes_keep_it_up_to_date(self):
+        response = self.client.post('/projects/', {
+            'title': "New", 'description': "New project", 'pledgetype': self.pledgetype.id, 'goal_amount': 100,
+            'image': "https://example.com/image.png", 'due_date': now() + timedelta(days=10), 'category': self.category.id
+        }, format='json')
+        project_id = response.data['id']
+        response = self.client.post(f'/projects/{project_id}/pledges/', {'amount': 30, 'comment': "Go!", 'anonymous': False}, format='json')
+        self.client.post(f'/projects/{project_id}/pledges/', {'amount': 20, 'comment': "Go!", 'anonymous': False}, format='json')
+        self.client.delete(f"/projects/{project_id}/pledges/{response.data['id']}/")
+        self.client.put(f'/projects/{project_id}/', {'goal_amount': 300}, format='json')
+
+        stats = self.stats()
+        self.assertEqual((stats['open_project_count'], stats['total_goal'], stats['total_pledged'], stats['pledge_count']), (6, 5300, 270, 26))
+        self.assertMatchesRebuild()
+
+        # moving the due date into the past takes it out, and back again puts it in again.
+        self.client.put(f'/projects/{project_id}/', {'due_date': now() - timedelta(days=1)}, format='json')
+        self.assertEqual(self.stats()['open_project_count'], 5)
+        self.assertMatchesRebuild()
+        self.client.put(f'/projects/{project_id}/', {'due_date': now() + timedelta(days=1)}, format='json')
+        self.assertEqual(self.stats()['open_project_count'], 6)
+        self.assertMatchesRebuild()
+
+    def test_projects_that_have_closed(self):
+        Project.objects.filter(pk=self.project.id).update(due_date=now() - timedelta(minutes=1))
+        # left out straight away, before close_due_projects has run.
+        self.assertEqual(self.stats()['open_project_count'], 4)
+        self.assertEqual(self.stats()['total_pledged'], 200)
+
+        call_command('close_due_projects', stdout=StringIO())
+        self.assertFalse(Project.objects.get(pk=self.project.id).counted_open)
+        self.assertMatchesRebuild()
+
+        # pledges on a closed project don't count.
+        self.client.post(f'/projects/{self.project.id}/pledges/', {'amount': 20, 'comment': "Go!", 'anonymous': False}, format='json')
+        self.assertEqual(self.stats()['total_pledged'], 200)
+
+
+class EventStreamTests(TransactionTestCase):
+    # a TransactionTestCase, because the events are only published once the pledge's transaction commits.
+
+    def setUp(self):
+        self.location = Location.objects.create(name="South Perth")
+        self.category = ProjectCategory.objects.create(name="Arts")
+        self.pledgetype = Pledgetype.objects.create(type="money")
+        self.user = CustomUser.objects.create(username="user", location=self.location)
+        self.project = create_project(self.user, self.category, self.pledgetype)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    async def open_stream(self, path):
+        # runs the ASGI app like a server would, returns the task, a queue of the messages it sends and a function to disconnect.
+        app = EventStreamApplication(application=None)
+        sent = asyncio.Queue()
+        disconnect = asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        scope = {'type': 'http', 'method': 'GET', 'path': path}
+        task = asyncio.ensure_future(app(scope, receive, sent.put))
+        return task, sent, disconnect.set
+
+    async def next_message(self, sent):
+        return await asyncio.wait_for(sent.get(), timeout=5)
+
+    def test_project_stream(self):
+        async def run():
+            task, sent, disconnect = await self.open_stream(f'/projects/{self.project.id}/events/')
+            start = await self.next_message(sent)
+            self.assertEqual(start['status'], 200)
+            self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+            # the current totals straight away.
+            first = (await self.next_message(sent))['body'].decode()
+            self.assertTrue(first.startswith("event: pledge-total\n"))
+            self.assertIsNone(json.loads(first.split("data: ")[1])['current_amount_pledged'])
+
+            await sync_to_async(self.client.post)(f'/projects/{self.project.id}/pledges/', {'amount': 250, 'comment': "Go!", 'anonymous': False}, format='json')
+            update = (await self.next_message(sent))['body'].decode()
+            self.assertEqual(json.loads(update.split("data: ")[1]), {
+                'id': self.project.id, 'current_amount_pledged': 250, 'current_percentage_pledged': 25, 'pledge_count': 1, 'last_milestone': 0
+            })
+
+            disconnect()
+            await asyncio.wait_for(task, timeout=5)
+        async_to_sync(run)()
+        # the stream has let go of its queue.
+        self.assertEqual(get_broker().subscriptions, {})
+
+    def test_location_stream_gets_activity(self):
+        async def run():
+            task, sent, disconnect = await self.open_stream(f'/locations/{self.location.id}/events/')
+            self.assertEqual((await self.next_message(sent))['status'], 200)
+
+            await sync_to_async(self.client.post)(f'/projects/{self.project.id}/progress-updates/', {'content': "Halfway!"}, format='json')
+            await sync_to_async(process_outbox)()
+            event = (await self.next_message(sent))['body'].decode()
+            self.assertTrue(event.startswith("event: activity\n"))
+            self.assertEqual(json.loads(event.split("data: ")[1])['action'], "progress-update")
+
+            disconnect()
+            await asyncio.wait_for(task, timeout=5)
+        async_to_sync(run)()
+
+    def test_keepalive_and_missing_streams(self):
+        async def run():
+            with override_settings(EVENTS={**settings.EVENTS, 'KEEPALIVE': 0.01}):
+                task, sent, disconnect = await self.open_stream(f'/locations/{self.location.id}/events/')
+                await self.next_message(sent)
+                self.assertEqual((await self.next_message(sent))['body'], b": keepalive\n\n")
+                disconnect()
+                await asyncio.wait_for(task, timeout=5)
+
+            task, sent, disconnect = await self.open_stream('/projects/0/events/')
+            self.assertEqual((await self.next_message(sent))['status'], 404)
+            await asyncio.wait_for(task, timeout=5)
+        async_to_sync(run)()
+
+    def test_database_lookups_close_old_connections(self):
+        # the streams run outside Django's request handling, so they have to do what request_started / request_finished would.
+        with mock.patch('crelo.sse.close_old_connections') as close_old_connections:
+            self.assertTrue(sse.stream_exists('project', self.project.id))
+            self.assertEqual(close_old_connections.call_count, 2)
+            sse.first_events('project', self.project.id)
+            self.assertEqual(close_old_connections.call_count, 4)
+
+    def test_broker_publishes_from_other_threads(self):
+        async def run():
+            broker = LocalBroker(queue_size=2)
+            subscription = broker.subscribe(['project-1'])
+            thread = threading.Thread(target=lambda: [broker.publish('project-1', 'activity', str(i)) for i in range(3)])
+            thread.start()
+            thread.join()
+            # the queue only holds 2, a client that isn't reading misses the rest.
+            self.assertEqual(await asyncio.wait_for(subscription.get(), timeout=5), ('activity', '0'))
+            self.assertEqual(await asyncio.wait_for(subscription.get(), timeout=5), ('activity', '1'))
+            self.assertTrue(subscription.queue.empty())
+            broker.unsubscribe(subscription)
+            self.assertEqual(broker.subscriptions, {})
+        async_to_sync(run)()
+
+
+class ExportTests(EndpointTestCase):
+
+    def download(self, url, client=None):
+        response = (client or self.client).get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_pledges_csv(self):
+        content = self.download(f'/projects/{self.project.id}/pledges/export.csv')
+        lines = content.splitlines()
+        self.assertEqual(lines[0], "id,amount,comment,anonymous,user,project_id,date_created,type_id")
+        self.assertEqual(len(lines), 1 + self.project.pledges.count())
+        self.assertRegex(lines[1], r'^\d+,10,Go!,false,\d+,%d,[\d\-]+T[\d:.]+Z,%d$' % (self.project.id, self.pledgetype.id))
+
+    def test_pledges_ndjson_matches_the_api(self):
+        content = self.download(f'/projects/{self.project.id}/pledges/export.ndjson?page_size=100')
+        exported = [json.loads(line) for line in content.splitlines()]
+        listed = self.client.get(f'/projects/{self.project.id}/pledges/?page_size=100').json()['results']
+        self.assertEqual(exported, sorted(listed, key=lambda pledge: pledge['id']))
+
+    def test_only_the_owner_can_export_pledges(self):
+        client = APIClient()
+        client.force_authenticate(self.users[1])
+        self.assertEqual(client.get(f'/projects/{self.project.id}/pledges/export.csv').status_code, 403)
+        self.assertEqual(APIClient().get(f'/projects/{self.project.id}/pledges/export.csv').status_code, 401)
+        self.assertEqual(self.client.get(f'/projects/{self.project.id}/pledges/export.xml').status_code, 404)
+
+    def test_activity_export_is_for_admins(self):
+        self.assertEqual(self.client.get('/activities/export.csv').status_code, 403)
+
+        admin = CustomUser.objects.create(username="admin", location=self.location, is_admin=True)
+        client = APIClient()
+        client.force_authenticate(admin)
+        lines = self.download('/activities/export.ndjson', client).splitlines()
+        self.assertEqual(len(lines), Activity.objects.count())
+        self.assertEqual(list(json.loads(lines[0])), ['id', 'action', 'datetime', 'user_id', 'location_id', 'project_id'])
+
+
+class QueryPlanTests(QueryPlanMixin, EndpointTestCase):
+
+    def test_project_endpoints(self):
+        self.assertIndexedPlan('/projects/')
+        self.assertIndexedPlan(f'/projects/{self.project.id}/')
+        self.assertIndexedPlan(f'/projects/{self.project.id}/pledges/')
+        self.assertIndexedPlan(f'/projects/{self.project.id}/progress-updates/')
+
+    def test_location_endpoints(self):
+        self.assertIndexedPlan(f'/locations/{self.location.id}/categories/')
+        self.assertIndexedPlan(f'/locations/{self.location.id}/categories/{self.category.id}/')
+        self.assertIndexedPlan(f'/locations/{self.location.id}/categories/favourites/')
+        self.assertIndexedPlan(f'/locations/{self.location.id}/activity/')
+
+    def test_activity_list(self):
+        self.assertIndexedPlan('/activities/')
+
+    def test_reference_lists(self):
+        # small lookup tables, reading all of them is the point.
+        self.assertIndexedPlan('/locations/', allow_scan=('projects_location',))
+        self.assertIndexedPlan('/pledges/types/', allow_scan=('projects_pledgetype',))
+        self.assertIndexedPlan('/project-categories/', allow_scan=('projects_projectcategory',))
+
+
+class ActivityOutboxTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.location = Location.objects.create(name="South Perth")
+        cls.user = CustomUser.objects.create(username="owner", location=cls.location)
+        cls.project = create_project(cls.user, ProjectCategory.objects.create(name="Arts"), Pledgetype.objects.create(type="money"))
+
+    def test_pledges_queue_activity_for_the_worker(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for amount in (300, 300, 300):
+            client.post(f'/projects/{self.project.id}/pledges/', {'amount': amount, 'comment': "Go!", 'anonymous': False}, format='json')
+
+        self.assertFalse(Activity.objects.exists())
+        self.assertEqual(ActivityOutbox.objects.count(), 3)
+        version = Project.objects.get(pk=self.project.id).version
+
+        self.assertEqual(process_outbox(batch_size=2), 2)
+        self.assertEqual(process_outbox(batch_size=2), 1)
+        self.assertEqual(process_outbox(batch_size=2), 0)
+
+        actions = ["milestone-25", "milestone-50", "milestone-75"]
+        self.assertEqual(list(Activity.objects.order_by('id').values_list('action', flat=True)), actions)
+        self.assertFalse(ActivityOutbox.objects.exists())
+
+        feed = DatabaseFeedBackend(size=10).read(self.location.id)
+        self.assertEqual([data['action'] for entry_id, data in feed], actions[::-1])
+        self.assertGreater(Project.objects.get(pk=self.project.id).version, version)
+
+    def test_worker_needs_a_shared_broker(self):
+        # with the in-process broker the activity it creates would never reach the web workers' event streams.
+        self.assertNotIsInstance(get_broker(), RedisBroker)
+        with self.assertRaisesMessage(CommandError, "REDIS_URL"):
+            call_command('run_activity_worker', once=True, stdout=StringIO())
+        call_command('run_activity_worker', once=True, without_live_events=True, stdout=StringIO())
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], REPLICA_STICKY_SECONDS=5)
+class ReplicaRouterTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+
+    def database_for(self, request):
+        # which database a read made while handling this request would use.
+        used = []
+        middleware = ReplicaPinningMiddleware(lambda request: used.append(self.router.db_for_read(Project)) or HttpResponse())
+        middleware(request)
+        return used[0]
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(self.router.db_for_read(Project), 'default')
+        self.assertEqual(self.router.db_for_write(Project), 'default')
+
+    def test_get_reads_from_replica(self):
+        self.assertEqual(self.database_for(self.factory.get('/projects/')), 'replica1')
+
+    def test_writes_use_primary_and_stick(self):
+        token = 'Token abc123'
+        self.assertEqual(self.database_for(self.factory.post('/projects/1/pledges/', HTTP_AUTHORIZATION=token)), 'default')
+
+        # the same client reads its own write from the primary, everyone else still uses the replica.
+        self.assertEqual(self.database_for(self.factory.get('/projects/1/', HTTP_AUTHORIZATION=token)), 'default')
+        self.assertEqual(self.database_for(self.factory.get('/projects/1/', HTTP_AUTHORIZATION='Token other')), 'replica1')
+
+        cache.clear()
+        self.assertEqual(self.database_for(self.factory.get('/projects/1/', HTTP_AUTHORIZATION=token)), 'replica1')
+
+
+class BenchmarkCommandTests(TestCase):
+
+    def test_generated_dataset_is_consistent_and_every_url_works(self):
+        call_command('generate_dataset', scale=1, stdout=StringIO())
+        self.assertEqual(Project.objects.count(), 100)
+        self.assertTrue(Pledge.objects.exists())
+        # spread out over the last 180 days, not all stamped with when the command ran.
+        self.assertEqual(Project.objects.values('date_created').distinct().count(), 100)
+        self.assertGreater(Pledge.objects.values('date_created').distinct().count(), 1)
+        self.assertFalse(Pledge.objects.filter(date_created__lt=F('project__date_created')).exists())
+
+        output = StringIO()
+        call_command('rebuild_pledge_totals', dry_run=True, stdout=output)
+        self.assertIn("All project pledge totals are correct.", output.getvalue())
+        call_command('rebuild_user_totals', dry_run=True, stdout=output)
+        self.assertIn("All user totals are correct.", output.getvalue())
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as results_file:
+            call_command('bench', requests=2, warmup=0, save=results_file.name, stdout=StringIO())
+            results = json.load(results_file)['results']
+
+        self.assertIn('projects/<int:pk>/', results)
+        self.assertIn('account/', results)
+        self.assertIn('account/pledges/', results)
+        self.assertNotIn('account/add-category/<pk>/', results)
+        self.assertIn('projects/<int:project_pk>/pledges/export.<str:export_format>', results)
+        # the sample user isn't an admin.
+        self.assertEqual(results.pop('activities/export.<str:export_format>')['status'], 403)
+        self.assertEqual({result['status'] for result in results.values()}, {200})
+
+
+class SQLiteBackendTests(TestCase):
+
+    def test_wal_and_single_writer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database = SQLiteDatabaseWrapper({**connection.settings_dict, 'NAME': os.path.join(directory, 'crelo.sqlite3')}, 'tuned')
+            with database.cursor() as cursor:
+                cursor.execute("PRAGMA journal_mode")
+                self.assertEqual(cursor.fetchone()[0], 'wal')
+                cursor.execute("PRAGMA synchronous")
+                # 1 = NORMAL
+                self.assertEqual(cursor.fetchone()[0], 1)
+
+            database._start_transaction_under_autocommit()
+            with database.cursor() as cursor:
+                cursor.execute("CREATE TABLE pledge (amount integer)")
+
+            # another process can't start writing until the transaction is over.
+            with open(database.writer_lock.path) as other_writer:
+                with self.assertRaises(BlockingIOError):
+                    fcntl.flock(other_writer, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                database._commit()
+                fcntl.flock(other_writer, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            database.close()
+
+    @override_settings(SQLITE={**settings.SQLITE, 'BUSY_TIMEOUT_MS': 50})
+    def test_writer_lock_times_out(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database = SQLiteDatabaseWrapper({**connection.settings_dict, 'NAME': os.path.join(directory, 'crelo.sqlite3')}, 'tuned')
+            database.ensure_connection()
+
+            with open(database.writer_lock.path, 'a') as other_writer:
+                fcntl.flock(other_writer, fcntl.LOCK_EX)
+                with self.assertRaisesMessage(OperationalError, "database is locked"):
+                    database._start_transaction_under_autocommit()
+                self.assertFalse(database.writer_lock.held)
+            database.close()
@@ -11,6 +11,7 @@ urlpatterns = [
     # Location views
     path('locations/', views.LocationList.as_view()),
     path('locations/<int:pk>/', views.LocationDetail.as_view()),
+    path('locations/<int:pk>/stats/', views.LocationStats.as_view()),
 
     # Project views
     path('projects/', views.ProjectList.as_view()),
@@ -24,9 +25,11 @@ urlpatterns = [
     path('projects/<int:project_pk>/progress-updates/<int:update_pk>/', views.ProgressUpdateDetail.as_view()),
     path('projects/<int:project_pk>/pledges/', views.PledgeList.as_view()),
     path('projects/<int:project_pk>/pledges/<int:pledge_pk>/', views.PledgeDetail.as_view()),
+    # export.csv or export.ndjson
+    path('projects/<int:project_pk>/pledges/export.<str:export_format>', views.PledgeExport.as_view()),
 
 
-    # path('locations/<int:pk>/activity/', views.LocationActivity.as_view()),    
+    path('locations/<int:pk>/activity/', views.LocationActivity.as_view()),
     
     
     # not using this url with slug below. Probably don't need to make it nice cos user won't see it I don't think - react should have it's own routes on the front end that the user sees...??
@@ -41,6 +44,7 @@ urlpatterns = [
     
     # EXPERIMENTAL...
     path('activities/', views.AllActivity.as_view()),
+    path('activities/export.<str:export_format>', views.ActivityExport.as_view()),
     
 ] 
 
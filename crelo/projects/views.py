@@ -1,5 +1,12 @@
+from django.conf import settings
 from django.http import Http404
+from django.db import transaction
+from django.db.models import F
+from django.utils.decorators import method_decorator
+from django.utils.timezone import now
+from django.views.decorators.http import condition
 from rest_framework import status, permissions
+from rest_framework.exceptions import ParseError
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from .models import Project, Pledge, Pledgetype, ProjectCategory, Location, ProgressUpdate, Activity
@@ -7,7 +14,17 @@ from .serializers import ProjectSerializer, ProjectDetailSerializer, PledgeSeria
 
 from django.dispatch import receiver, Signal
 
-from .permissions import IsOwnerOrReadOnly, IsProjectOwnerOrReadOnly, IsAdminOrReadOnly
+from .permissions import IsOwnerOrReadOnly, IsProjectOwnerOrReadOnly, IsAdminOrReadOnly, IsOwner, IsAdmin
+from .pagination import CreloCursorPagination, CreloLimitOffsetPagination, FeedPagination
+from .feeds import get_feed_backend
+from .outbox import emit_activity
+from . import events, stats
+from .cache import cached_response
+from .renderers import FAST_RENDERER_CLASSES
+from .exports import export_response
+from users.models import CustomUser
+from .fieldsets import requested_fields, requested_expansions
+from .rows import PROJECT_FIELDS, PLEDGE_COLUMNS, ACTIVITY_COLUMNS, project_values, project_rows, pledge_values, pledge_rows, activity_values, activity_rows
 
 # SIGNAL FUNCTIONS...
 
@@ -20,33 +37,103 @@ def activity_signal_receiver(sender, **kwargs):
 
     activity_serializer = ActivitySerializer(data=activity_data)
     if activity_serializer.is_valid():
-        activity_serializer.save(
+        # only queues the activity, the run_activity_worker command creates it (and updates the feed and the project's ETag) - see projects/outbox.py.
+        emit_activity(
+            action=activity_serializer.validated_data['action'],
             user=kwargs.get('user'), 
             project=kwargs.get('project'),
             location=kwargs.get('location')
         )
 
 
+# ETags for the views that clients poll. They only need the project's version number (one indexed lookup), so an unchanged project gets a 304 without serializing anything.
+# is_open and location_id can change without the project being saved (the due date passes, the owner moves), so they're in it too.
+
+def project_etag(request, pk=None, project_pk=None):
+    project_id = pk if pk is not None else project_pk
+    row = Project.objects.filter(pk=project_id).values_list('version', 'due_date', 'user__location_id').first()
+    if row is None:
+        return None
+    version, due_date, location_id = row
+    state = 'open' if due_date > now() else 'closed'
+    return f"project-{project_id}-{version}-{state}-{location_id}"
+
+def project_detail_etag(request, pk):
+    # ?fields= / ?expand= change the content. Parsed the same way as the view does, so the same fields in another order (or
+    # unrelated params) share an ETag, and a request the view is going to turn down with a 400 doesn't get one.
+    try:
+        fields = requested_fields(request, PROJECT_FIELDS)
+        expand = requested_expansions(request, ProjectDetailSerializer.expandable)
+    except ParseError:
+        return None
+    etag = project_etag(request, pk=pk)
+    if etag is None:
+        return None
+    if fields is not None:
+        etag += "-fields:" + ",".join(fields)
+    if expand is not None:
+        etag += "-expand:" + ",".join(expand)
+    return etag
+
+def pledge_list_etag(request, project_pk):
+    etag = project_etag(request, project_pk=project_pk)
+    if etag is None:
+        return None
+    # different pages / page sizes of the same project have different content.
+    return f"{etag}-pledges-{request.META.get('QUERY_STRING', '')}"
+
+
 class ProjectList(APIView):
 
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    renderer_classes = FAST_RENDERER_CLASSES
 
     def get(self, request):
-        projects = Project.objects.all()
-        # note, in the serializer we have to pass in many=True. What it means in DRF is since your serializer.data is going to be a list and each item in the list needs to be converted to json. So it's many because there's more than one object to be parsed.
-        serializer = ProjectSerializer(projects, many=True)
-        return Response(serializer.data)
+        if 'ids' in request.query_params:
+            return self.get_by_ids(request)
+
+        # plain dicts from .values() instead of ProjectSerializer(page, many=True), it's the same output but a lot less work per row (see projects/rows.py).
+        fields = requested_fields(request, PROJECT_FIELDS)
+        projects = project_values(Project.objects.all(), fields)
+        paginator = CreloCursorPagination(ordering='-date_created')
+        page = paginator.paginate_queryset(projects, request, view=self)
+        return paginator.get_paginated_response(project_rows(page, fields))
+
+    def get_by_ids(self, request):
+        # ?ids=1,2,3 - the same as /projects/<pk>/ for each of them (?fields= and ?expand= work too), but in one query plus one per embedded list.
+        try:
+            ids = list(dict.fromkeys(int(project_id) for project_id in request.query_params['ids'].split(',') if project_id.strip()))
+        except ValueError:
+            raise ParseError("ids needs to be a comma separated list of numbers.")
+        if len(ids) > settings.MAX_PAGE_SIZE:
+            raise ParseError(f"At most {settings.MAX_PAGE_SIZE} ids at a time.")
+
+        fields = requested_fields(request, PROJECT_FIELDS)
+        expand = requested_expansions(request, ProjectDetailSerializer.expandable)
+        projects = ProjectDetailSerializer.setup_eager_loading(Project.objects.filter(id__in=ids), fields, expand).in_bulk()
+        # in the order they were asked for, leaving out any that don't exist.
+        found = [projects[project_id] for project_id in ids if project_id in projects]
+        serializer = ProjectDetailSerializer(found, many=True, fields=fields, expand=expand)
+        return Response({'results': serializer.data})
 
     def post(self, request):
         serializer = ProjectSerializer(data=request.data)
         
         if serializer.is_valid():
             print("about to save the new project serializer")
-            serializer.save(user=request.user, location_id=request.user.location.id)
+            with transaction.atomic():
+                new_project = serializer.save(user=request.user, location_id=request.user.location_id)
+                CustomUser.objects.filter(pk=request.user.id).update(project_count=F('project_count') + 1)
+                if new_project.is_open:
+                    stats.add_project(new_project)
+                else:
+                    Project.objects.filter(pk=new_project.pk).update(counted_open=False)
 
-            project = Project.objects.get(pk=serializer.data['id'])
+                # the location comes along with the project, rather than another query through request.user.location.
+                project = Project.objects.select_related('location').get(pk=new_project.pk)
 
-            activity_signal.send(sender=ProgressUpdate, action="project-created", user=request.user, project=project, location=request.user.location)
+                # in the same transaction as the project, so its activity is queued if and only if the project exists.
+                activity_signal.send(sender=ProgressUpdate, action="project-created", user=request.user, project=project, location=project.location)
 
             return Response(
                 serializer.data,
@@ -63,15 +150,18 @@ class ProjectDetail(APIView):
 
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
 
-    def get_object(self, pk):
+    def get_object(self, pk, fields=None, expand=None):
         try:
-            return Project.objects.get(pk=pk)
+            return ProjectDetailSerializer.setup_eager_loading(Project.objects.all(), fields, expand).get(pk=pk)
         except Project.DoesNotExist:
             raise Http404
     
+    @method_decorator(condition(etag_func=project_detail_etag))
     def get(self, request, pk):
-        project = self.get_object(pk)
-        serializer = ProjectDetailSerializer(project)
+        fields = requested_fields(request, PROJECT_FIELDS)
+        expand = requested_expansions(request, ProjectDetailSerializer.expandable)
+        project = self.get_object(pk, fields, expand)
+        serializer = ProjectDetailSerializer(project, fields=fields, expand=expand)
         return Response(serializer.data)
 
     def put(self, request, pk):
@@ -79,7 +169,24 @@ class ProjectDetail(APIView):
         # Have to pass in as third agrument partial=True, otherwise the serializer will require a value to be submitted for EVERY property EVERY time.
         serializer = ProjectDetailSerializer(project, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                # the goal and due date can change, so take the project out of the location stats as it was and put it back in as it is now.
+                before = Project.objects.select_for_update().get(pk=pk)
+                project = serializer.save()
+                Project.objects.filter(pk=project.pk).touch()
+
+                if before.counted_open:
+                    stats.remove_project(before)
+                project.refresh_from_db(fields=['current_amount', 'pledge_count', 'last_milestone', 'version'])
+                project.counted_open = project.is_open
+                if project.counted_open:
+                    stats.add_project(project)
+                Project.objects.filter(pk=project.pk).update(counted_open=project.counted_open)
+
+            # a smaller goal_amount can push the project past a milestone too.
+            for milestone in project.check_for_milestone():
+                activity_signal.send(sender=Project, action=f"milestone-{milestone}", user=project.user, project=project, location=project.location)
+
             return Response(serializer.data) # status=200 so no need to include - it's the default.
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -89,9 +196,11 @@ class ProgressUpdateList(APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsProjectOwnerOrReadOnly]
     
     def get(self, request, project_pk):
-        progress_updates = ProgressUpdate.objects.filter(project_id=project_pk)
-        serializer = ProgressUpdateSerializer(progress_updates, many=True)
-        return Response(serializer.data)
+        progress_updates = ProgressUpdateSerializer.setup_eager_loading(ProgressUpdate.objects.filter(project_id=project_pk))
+        paginator = CreloCursorPagination(ordering='-date_posted')
+        page = paginator.paginate_queryset(progress_updates, request, view=self)
+        serializer = ProgressUpdateSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     def post(self, request, project_pk):
 
@@ -101,9 +210,9 @@ class ProgressUpdateList(APIView):
         location = Location.objects.get(pk=project.location_id)
 
         if serializer.is_valid():
-            serializer.save(project_id=project.id)
-
-            activity_signal.send(sender=ProgressUpdate, action="progress-update", user=request.user, project=project, location=location)
+            with transaction.atomic():
+                serializer.save(project_id=project.id)
+                activity_signal.send(sender=ProgressUpdate, action="progress-update", user=request.user, project=project, location=location)
 
             return Response(
                 serializer.data,
@@ -135,29 +244,52 @@ class ProgressUpdateDetail(APIView):
         serializer = ProgressUpdateSerializer(progress_update, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
+            Project.objects.filter(pk=progress_update.project_id).touch()
             return Response(serializer.data) # status=200 so no need to include - it's the default.
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, project_pk, update_pk):
         progress_update = self.get_object(update_pk)
         progress_update.delete()
+        Project.objects.filter(pk=progress_update.project_id).touch()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class PledgeList(APIView):
 
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    renderer_classes = FAST_RENDERER_CLASSES
 
+    @method_decorator(condition(etag_func=pledge_list_etag))
     def get(self, request, project_pk):
-        pledges = Pledge.objects.filter(project_id=project_pk)
-        serializer = PledgeSerializer(pledges, many=True)
-        return Response(serializer.data)
+        pledges = pledge_values(Pledge.objects.filter(project_id=project_pk))
+        paginator = CreloCursorPagination(ordering='-date_created')
+        page = paginator.paginate_queryset(pledges, request, view=self)
+        return paginator.get_paginated_response(pledge_rows(page))
 
     def post(self, request, project_pk):
         serializer = PledgeSerializer(data=request.data)
         if serializer.is_valid():
             project = Project.objects.get(id=project_pk)
-            serializer.save(user=request.user, project_id=project_pk, type_id=project.pledgetype.id)
+            # save the pledge and bump the project's running totals together so they can't get out of sync.
+            with transaction.atomic():
+                pledge = serializer.save(user=request.user, project_id=project_pk, type_id=project.pledgetype.id)
+                Project.objects.filter(pk=project_pk).update(
+                    current_amount=F('current_amount') + pledge.amount,
+                    pledge_count=F('pledge_count') + 1,
+                    version=F('version') + 1
+                )
+                CustomUser.objects.filter(pk=request.user.id).update(
+                    pledge_count=F('pledge_count') + 1,
+                    total_pledged=F('total_pledged') + pledge.amount
+                )
+
+                project.refresh_from_db(fields=['current_amount', 'pledge_count', 'last_milestone', 'counted_open'])
+                if project.counted_open:
+                    stats.adjust_stats(project.location_id, project.category_id, total_pledged=pledge.amount, pledge_count=1)
+                events.publish_pledge_total(project.id)
+                for milestone in project.check_for_milestone():
+                    activity_signal.send(sender=Project, action=f"milestone-{milestone}", user=project.user, project=project, location=project.location)
             return Response(
                 serializer.data,
                 status=status.HTTP_201_CREATED
@@ -168,6 +300,22 @@ class PledgeList(APIView):
         )
 
 
+
+class PledgeExport(APIView):
+    # all of a project's pledges as CSV or NDJSON, for the project's owner.
+
+    permission_classes = [permissions.IsAuthenticated, IsOwner]
+
+    def get(self, request, project_pk, export_format):
+        try:
+            project = Project.objects.only('id', 'user_id').get(pk=project_pk)
+        except Project.DoesNotExist:
+            raise Http404
+        self.check_object_permissions(request, project)
+
+        pledges = pledge_values(Pledge.objects.filter(project_id=project_pk).order_by('id'))
+        return export_response(export_format, f"project-{project_pk}-pledges", PLEDGE_COLUMNS, pledges, pledge_rows)
+
 class PledgeDetail(APIView):
 
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
@@ -185,7 +333,25 @@ class PledgeDetail(APIView):
 
     def delete(self, request, project_pk, pledge_pk):
         pledge = self.get_object(pledge_pk)
-        pledge.delete()
+        with transaction.atomic():
+            # delete first, and only take the pledge off the totals if it was this request that deleted it - two DELETEs of the
+            # same pledge at the same time would otherwise both subtract it.
+            deleted, _ = Pledge.objects.filter(pk=pledge.pk).delete()
+            if not deleted:
+                raise Http404
+            Project.objects.filter(pk=pledge.project_id).update(
+                current_amount=F('current_amount') - pledge.amount,
+                pledge_count=F('pledge_count') - 1,
+                version=F('version') + 1
+            )
+            CustomUser.objects.filter(pk=pledge.user_id).update(
+                pledge_count=F('pledge_count') - 1,
+                total_pledged=F('total_pledged') - pledge.amount
+            )
+            project = Project.objects.only('location_id', 'category_id', 'counted_open').get(pk=pledge.project_id)
+            if project.counted_open:
+                stats.adjust_stats(project.location_id, project.category_id, total_pledged=-pledge.amount, pledge_count=-1)
+            events.publish_pledge_total(pledge.project_id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -193,6 +359,7 @@ class PledgetypeList(APIView):
 
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsAdminOrReadOnly]
 
+    @cached_response('pledgetypes')
     def get(self, request):
         pledgetypes = Pledgetype.objects.all()
         serializer = PledgetypeSerializer(pledgetypes, many=True)
@@ -223,6 +390,7 @@ class PledgetypeDetail(APIView):
         except Project.DoesNotExist:
             raise Http404
 
+    @cached_response('pledgetypes')
     def get(self, request, pk):
         pledgetype = self.get_object(pk)
         serializer = PledgetypeSerializer(pledgetype)
@@ -248,6 +416,7 @@ class ProjectCategoryList(APIView):
 
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsAdminOrReadOnly]
 
+    @cached_response('categories')
     def get(self, request):
         categories = ProjectCategory.objects.all()
         serializer = ProjectCategorySerializer(categories, many=True)
@@ -278,6 +447,7 @@ class ProjectCategoryDetail(APIView):
         except Project.DoesNotExist:
             raise Http404
 
+    @cached_response('categories')
     def get(self, request, pk):
         category = self.get_object(pk)
         serializer = ProjectCategorySerializer(category)
@@ -303,10 +473,14 @@ class LocationList(APIView):
 
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsAdminOrReadOnly]
 
+    @cached_response('locations')
     def get(self, request):
-        location = Location.objects.all()
-        serializer = LocationSerializer(location, many=True)
-        return Response(serializer.data)
+        location = Location.objects.all().order_by('id')
+        # there aren't many locations so a plain limit/offset (with a count) is fine here.
+        paginator = CreloLimitOffsetPagination()
+        page = paginator.paginate_queryset(location, request, view=self)
+        serializer = LocationSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     #ADMIN ONLY!!! Might need to use a mixin??
     def post(self, request):
@@ -333,6 +507,7 @@ class LocationDetail(APIView):
         except Project.DoesNotExist:
             raise Http404
 
+    @cached_response('locations')
     def get(self, request, pk):
         location = self.get_object(pk)
         serializer = LocationSerializer(location)
@@ -353,6 +528,16 @@ class LocationDetail(APIView):
         location.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+class LocationStats(APIView):
+    # open project count, total goal, total pledged and pledge count for a location, overall and per category. Read from the LocationCategoryStats rollup (see projects/stats.py).
+
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+
+    def get(self, request, pk):
+        if not Location.objects.filter(pk=pk).exists():
+            raise Http404
+        return Response(stats.location_stats(pk))
+
 # class LocationSLUGDetail(APIView):
 
 #     def get(self, request, location):
@@ -364,43 +549,50 @@ class LocationDetail(APIView):
 class ProjectListByLocation(APIView):
 
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    renderer_classes = FAST_RENDERER_CLASSES
 
     def get(self, request, pk):
-        projects = Project.objects.filter(location=pk)
-        open_projects = [item for item in projects if item.is_open]
-        serializer = ProjectSerializer(open_projects, many=True)
-        return Response(serializer.data)
+        fields = requested_fields(request, PROJECT_FIELDS)
+        open_projects = project_values(Project.objects.open().filter(location=pk), fields)
+        # ordered by due_date so the (location, due_date) index covers both the filter and the sort.
+        paginator = CreloCursorPagination(ordering='due_date')
+        page = paginator.paginate_queryset(open_projects, request, view=self)
+        return paginator.get_paginated_response(project_rows(page, fields))
 
 
 class ProjectListByLocationAndCategory(APIView):
 
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    renderer_classes = FAST_RENDERER_CLASSES
 
     def get(self, request, loc_pk, cat_pk):
-        projects = Project.objects.filter(location=loc_pk, category=cat_pk)
-        open_projects = [item for item in projects if item.is_open]
-        serializer = ProjectSerializer(open_projects, many=True)
-        return Response(serializer.data)
+        fields = requested_fields(request, PROJECT_FIELDS)
+        open_projects = project_values(Project.objects.open().filter(location=loc_pk, category=cat_pk), fields)
+        paginator = CreloCursorPagination(ordering='due_date')
+        page = paginator.paginate_queryset(open_projects, request, view=self)
+        return paginator.get_paginated_response(project_rows(page, fields))
 
 class ProjectListFiltered(APIView):
 
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    renderer_classes = FAST_RENDERER_CLASSES
 
     def get(self, request, loc_pk):
 
         if request.user.is_authenticated:
-            user_categories = ProjectCategory.objects.filter(customuser__id=self.request.user.id)
-
-            projects = Project.objects.filter(location=loc_pk)
-
-            # adding the query sets together using the "|" 
-            for cat_id in user_categories:
-                projects = projects |Project.objects.filter(category=cat_id)
-
-            open_projects = [item for item in projects if item.is_open]
-            serializer = ProjectSerializer(open_projects, many=True)
+            # the user's favourite categories go in as a subquery, so this is one query however many favourites they have.
+            favourite_category_ids = request.user.favourite_categories.through.objects.filter(
+                customuser_id=request.user.id
+            ).values('projectcategory_id')
+
+            fields = requested_fields(request, PROJECT_FIELDS)
+            open_projects = project_values(
+                Project.objects.open().filter(location=loc_pk, category__in=favourite_category_ids), fields
+            )
+            paginator = CreloCursorPagination(ordering='due_date')
+            page = paginator.paginate_queryset(open_projects, request, view=self)
 
-            return Response(serializer.data)
+            return paginator.get_paginated_response(project_rows(page, fields))
         
         raise Http404
 
@@ -415,22 +607,34 @@ class ProjectListFiltered(APIView):
 class AllActivity(APIView):
 
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    renderer_classes = FAST_RENDERER_CLASSES
 
     def get(self, request):
-        activities = Activity.objects.all()
-        serializer = ActivitySerializer(activities, many=True)
-        return Response(serializer.data)
+        activities = activity_values(Activity.objects.all())
+        paginator = CreloCursorPagination(ordering='-datetime')
+        page = paginator.paginate_queryset(activities, request, view=self)
+        return paginator.get_paginated_response(activity_rows(page))
+
+
+class ActivityExport(APIView):
+    # the whole activity log as CSV or NDJSON, for admins.
+
+    permission_classes = [permissions.IsAuthenticated, IsAdmin]
+
+    def get(self, request, export_format):
+        activities = activity_values(Activity.objects.order_by('id'))
+        return export_response(export_format, "activity", ACTIVITY_COLUMNS, activities, activity_rows)
 
 class LocationActivity(APIView):
 
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    renderer_classes = FAST_RENDERER_CLASSES
     
     def get(self, request, pk):
-        activity_feed = Activity.objects.filter(location=pk).order_by('-datetime')[:10]
-
-        serializer = ActivityDetailSerializer(activity_feed, many=True)
-
-        return Response(serializer.data)
+        # the feed entries are already rendered with ActivityFeedSerializer when the activity is created (see activity_signal_receiver), so no serializer here.
+        paginator = FeedPagination()
+        page = paginator.paginate_feed(get_feed_backend(), pk, request)
+        return paginator.get_paginated_response(page)
 
     
 
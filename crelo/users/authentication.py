@@ -0,0 +1,137 @@
+import collections
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.utils.module_loading import import_string
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .models import CustomUser
+
+
+class TokenUserCache:
+    # Small LRU of token key -> user, so TokenAuthentication doesn't have to query authtoken_token + users_customuser on every request.
+    # Entries expire after `ttl` seconds. Each gunicorn worker has its own, and deleting a token or changing / deleting a user only
+    # clears the entries in the worker that did it, so the ttl is also how long another worker can keep using an old entry.
+    #
+    # Only the user's column values are kept, and every get() builds a new CustomUser from them, so nothing one request does to its
+    # user (or caches on it, like prefetched favourite categories) is seen by another.
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        # user id -> their token keys in entries, so a changed user can be dropped without going through the whole cache.
+        self.user_keys = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                values = entry[0]
+                return CustomUser.from_db('default', list(values), list(values.values()))
+            if entry is not None:
+                self.discard(key)
+            self.misses += 1
+            return None
+
+    def set(self, key, user):
+        values = {field.attname: getattr(user, field.attname) for field in CustomUser._meta.concrete_fields}
+        with self.lock:
+            if key in self.entries:
+                self.discard(key)
+            self.entries[key] = (values, time.monotonic() + self.ttl)
+            self.user_keys.setdefault(user.id, set()).add(key)
+            while len(self.entries) > self.size:
+                self.discard(next(iter(self.entries)))
+
+    def discard(self, key):
+        # the lock has to be held already.
+        values, expires = self.entries.pop(key)
+        keys = self.user_keys[values['id']]
+        keys.discard(key)
+        if not keys:
+            del self.user_keys[values['id']]
+
+    def remove_token(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.discard(key)
+
+    def remove_user(self, user_id):
+        with self.lock:
+            for key in list(self.user_keys.get(user_id, ())):
+                self.discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.user_keys.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self.entries),
+            }
+
+
+token_cache = TokenUserCache(size=settings.TOKEN_AUTH_CACHE['SIZE'], ttl=settings.TOKEN_AUTH_CACHE['TTL'])
+
+
+def report_stats():
+    # calls settings.TOKEN_AUTH_CACHE['STATS_HOOK'] (a dotted path to a function taking the stats dict) every STATS_EVERY lookups.
+    hook = settings.TOKEN_AUTH_CACHE['STATS_HOOK']
+    if not hook:
+        return
+    stats = token_cache.stats()
+    if (stats['hits'] + stats['misses']) % settings.TOKEN_AUTH_CACHE['STATS_EVERY'] == 0:
+        import_string(hook)(stats)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        user = token_cache.get(key)
+
+        if user is None:
+            try:
+                # the user's location_id and is_admin come with it, so the views don't need another query for them.
+                token = Token.objects.select_related('user').get(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            user = token.user
+            token_cache.set(key, user)
+
+        report_stats()
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        return (user, key)
+
+
+def forget_token(sender, instance, **kwargs):
+    token_cache.remove_token(instance.key)
+
+
+def forget_user(sender, instance, **kwargs):
+    token_cache.remove_user(instance.id)
+
+
+post_delete.connect(forget_token, sender=Token, dispatch_uid='token_cache_forget_token')
+post_save.connect(forget_user, sender=CustomUser, dispatch_uid='token_cache_forget_user_save')
+post_delete.connect(forget_user, sender=CustomUser, dispatch_uid='token_cache_forget_user_delete')
@@ -0,0 +1,42 @@
+# Generated by Django 3.0.8 on 2026-10-18 07:34
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_user_totals(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    # two separate queries, joining the projects and the pledges in one would multiply the rows together.
+    project_counts = dict(CustomUser.objects.annotate(count=Count('user_projects')).values_list('id', 'count'))
+    for user in CustomUser.objects.annotate(total=Sum('user_pledges__amount'), count=Count('user_pledges')):
+        user.project_count = project_counts[user.id]
+        user.pledge_count = user.count
+        user.total_pledged = user.total or 0
+        user.save(update_fields=['project_count', 'pledge_count', 'total_pledged'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+        ('projects', '0012_user_created_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='pledge_count',
+            field=models.IntegerField(blank=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='project_count',
+            field=models.IntegerField(blank=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='total_pledged',
+            field=models.IntegerField(blank=True, default=0),
+        ),
+        migrations.RunPython(backfill_user_totals, migrations.RunPython.noop),
+    ]
@@ -13,6 +13,10 @@ class CustomUser(AbstractUser):
     image = models.URLField(blank=True, default="")
     is_admin = models.BooleanField(blank=True, default=False)
     favourite_categories = models.ManyToManyField(ProjectCategory, related_name='customuser', blank=True)
+    # summary counters for the account page, kept up to date by ProjectList.post, PledgeList.post and PledgeDetail.delete (see rebuild_user_totals command if they ever drift).
+    project_count = models.IntegerField(default=0, blank=True)
+    pledge_count = models.IntegerField(default=0, blank=True)
+    total_pledged = models.IntegerField(default=0, blank=True)
 
     def __str__(self):
         return self.username
@@ -1,3 +1,5 @@
+from django.db.models import Count, Q
+from django.utils.timezone import now
 from rest_framework import serializers
 from .models import CustomUser
 
@@ -15,6 +17,10 @@ class CustomUserSerializer(serializers.Serializer):
     image = serializers.URLField(required=False)
     favourite_categories = serializers.PrimaryKeyRelatedField(queryset=ProjectCategory.objects.all(), many=True, required=False)
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.prefetch_related('favourite_categories')
+
     def create(self, validated_data):
 
         new_user = CustomUser.objects.create(
@@ -38,9 +44,21 @@ class CustomUserSerializer(serializers.Serializer):
             cats = validated_data['favourite_categories']
             instance.favourite_categories.set(cats)
 
-        instance.save()
+        # only the profile fields, a plain save() would write back the summary counters as they were when the user was loaded and lose any pledges made since.
+        instance.save(update_fields=['username', 'location_id', 'bio', 'image'])
 
         return instance
-      
-        
-       
\ No newline at end of file
+
+
+class UserSummarySerializer(serializers.Serializer):
+    # the counters on the account page. Projects and pledges themselves are paginated separately (account/projects/, account/pledges/).
+
+    project_count = serializers.ReadOnlyField()
+    pledge_count = serializers.ReadOnlyField()
+    total_pledged = serializers.ReadOnlyField()
+    active_project_count = serializers.ReadOnlyField()
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # open projects change with the clock rather than on a write, so they're counted when asked for - only the user's own projects get looked at (project_user_created_idx).
+        return queryset.annotate(active_project_count=Count('user_projects', filter=Q(user_projects__due_date__gt=now())))
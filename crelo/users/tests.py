@@ -1,3 +1,182 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.utils.timezone import now
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from projects.models import Location, ProjectCategory, Pledgetype, Pledge
+from projects.tests import QueryBudgetMixin, QueryPlanMixin, create_project
+from .authentication import token_cache
+from .models import CustomUser
+
+
+class UserEndpointTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.location = Location.objects.create(name="South Perth")
+        cls.category = ProjectCategory.objects.create(name="Arts")
+        cls.pledgetype = Pledgetype.objects.create(type="money")
+        cls.users = [CustomUser.objects.create(username=f"user-{i}", location=cls.location) for i in range(5)]
+
+        for user in cls.users:
+            user.favourite_categories.add(cls.category)
+            project = create_project(user, cls.category, cls.pledgetype)
+            for pledger in cls.users:
+                Pledge.objects.create(amount=10, comment="Go!", anonymous=False, project=project, user=pledger, type=cls.pledgetype)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+class QueryBudgetTests(QueryBudgetMixin, UserEndpointTestCase):
+
+    def test_user_list(self):
+        self.assertQueryBudget('/users/', 2)
+
+    def test_user_detail(self):
+        self.assertQueryBudget(f'/users/{self.users[0].id}/', 2)
+
+    def test_account(self):
+        self.assertQueryBudget('/account/', 2)
+
+    def test_account_projects_and_pledges(self):
+        self.assertQueryBudget('/account/projects/', 1)
+        self.assertQueryBudget('/account/pledges/', 1)
+
+
+class QueryPlanTests(QueryPlanMixin, UserEndpointTestCase):
+
+    def test_user_endpoints(self):
+        # the user list is read in primary key order, which is a scan of the table (stopped by the LIMIT).
+        self.assertIndexedPlan('/users/', allow_scan=('users_customuser',))
+        self.assertIndexedPlan(f'/users/{self.users[0].id}/')
+        self.assertIndexedPlan('/account/')
+        self.assertIndexedPlan('/account/projects/')
+        self.assertIndexedPlan('/account/pledges/')
+
+
+class AccountTests(UserEndpointTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # the fixtures above are made straight through the ORM, so set the counters the way the views would have.
+        call_command('rebuild_user_totals', stdout=StringIO())
+
+    def summary(self):
+        response = self.client.get('/account/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data), {'user', 'summary'})
+        return response.data['summary']
+
+    def test_summary(self):
+        create_project(self.users[0], self.category, self.pledgetype, due_in_days=-1)
+        self.assertEqual(self.summary(), {'project_count': 1, 'pledge_count': 5, 'total_pledged': 50, 'active_project_count': 1})
+
+    def test_counters_follow_writes(self):
+        response = self.client.post('/projects/', {
+            'title': "New", 'description': "New project", 'pledgetype': self.pledgetype.id, 'goal_amount': 100,
+            'image': "https://example.com/image.png", 'due_date': now() + timedelta(days=10), 'category': self.category.id
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(f"/projects/{response.data['id']}/pledges/", {'amount': 25, 'comment': "Go!", 'anonymous': False}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.summary(), {'project_count': 2, 'pledge_count': 6, 'total_pledged': 75, 'active_project_count': 2})
+
+        self.client.delete(f"/projects/{response.data['project_id']}/pledges/{response.data['id']}/")
+        self.assertEqual(self.summary(), {'project_count': 2, 'pledge_count': 5, 'total_pledged': 50, 'active_project_count': 2})
+
+        output = StringIO()
+        call_command('rebuild_user_totals', dry_run=True, stdout=output)
+        self.assertIn("All user totals are correct.", output.getvalue())
+
+    def test_put_returns_only_the_user(self):
+        response = self.client.put('/account/', {'username': "renamed"}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['username'], "renamed")
+        self.assertNotIn('projects', response.data)
+        # the profile save doesn't touch the counters.
+        self.assertEqual(self.summary()['pledge_count'], 5)
+
+    def test_projects_and_pledges_are_paginated(self):
+        response = self.client.get('/account/pledges/', {'page_size': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual({pledge['user'] for pledge in response.data['results']}, {self.users[0].id})
+        self.assertIsNotNone(response.data['next'])
+
+        response = self.client.get('/account/projects/')
+        self.assertEqual([project['user'] for project in response.data['results']], [self.users[0].id])
+
+    def test_anonymous(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/account/projects/').status_code, 401)
+        self.assertEqual(self.client.get('/account/pledges/').status_code, 401)
+
+
+class CachedTokenAuthenticationTests(UserEndpointTestCase):
+
+    def setUp(self):
+        token_cache.clear()
+        self.token = Token.objects.create(user=self.users[0])
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_second_request_skips_token_lookup(self):
+        first = self.count_queries('/account/')
+        second = self.count_queries('/account/')
+        self.assertEqual(second, first - 1)
+        self.assertEqual(token_cache.stats()['hits'], 1)
+        self.assertEqual(token_cache.stats()['misses'], 1)
+
+    def test_deleted_token_is_forgotten(self):
+        self.count_queries('/account/')
+        self.token.delete()
+        response = self.client.get('/account/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_updated_user_is_forgotten(self):
+        self.count_queries('/account/')
+        user = CustomUser.objects.get(pk=self.users[0].id)
+        user.is_active = False
+        user.save()
+        response = self.client.get('/account/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_deleted_user_is_forgotten(self):
+        self.count_queries('/account/')
+        CustomUser.objects.get(pk=self.users[0].id).delete()
+        response = self.client.get('/account/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_each_request_gets_its_own_user(self):
+        token_cache.set(self.token.key, self.users[0])
+        first = token_cache.get(self.token.key)
+        first.username = "changed"
+        first._prefetched_objects_cache = {'favourite_categories': []}
+
+        second = token_cache.get(self.token.key)
+        self.assertIsNot(second, first)
+        self.assertEqual(second.username, self.users[0].username)
+        self.assertFalse(hasattr(second, '_prefetched_objects_cache'))
+        self.assertFalse(second._state.adding)
+
+    def test_remove_user_only_drops_their_tokens(self):
+        other = Token.objects.create(user=self.users[1])
+        token_cache.set(self.token.key, self.users[0])
+        token_cache.set(other.key, self.users[1])
 
-# Create your tests here.
+        token_cache.remove_user(self.users[0].id)
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.assertEqual(token_cache.get(other.key).id, self.users[1].id)
@@ -7,6 +7,8 @@ urlpatterns = [
     path('users/', views.CustomUserList.as_view()),
     path('users/<int:pk>/', views.CustomUserDetail.as_view()),
     path('account/', views.AuthenticatedUserProfile.as_view()),
+    path('account/projects/', views.AccountProjectList.as_view()),
+    path('account/pledges/', views.AccountPledgeList.as_view()),
     path('account/add-category/<pk>/', views.UserAddCategory.as_view()),
     path('account/remove-category/<pk>/', views.UserRemoveCategory.as_view()),
 ]
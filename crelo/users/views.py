@@ -4,10 +4,14 @@ from rest_framework.response import Response
 from rest_framework import status, permissions
 
 from .models import CustomUser
-from .serializers import CustomUserSerializer
+from .serializers import CustomUserSerializer, UserSummarySerializer
 
 from projects.models import Pledge, Project, ProjectCategory
-from projects.serializers import PledgeSerializer, ProjectSerializer, ProjectCategorySerializer
+from projects.serializers import ProjectCategorySerializer
+from projects.pagination import CreloCursorPagination
+from projects.renderers import FAST_RENDERER_CLASSES
+from projects.fieldsets import requested_fields
+from projects.rows import PROJECT_FIELDS, project_values, project_rows, pledge_values, pledge_rows
 
 # Not using IsAdmin in this file. Remove it from the import unless that changes on Wednesday...
 from .permissions import IsLoggedInUserOrReadOnly, IsLoggedInUser, IsAdminOrReadOnly
@@ -17,9 +21,11 @@ class CustomUserList(APIView):
 
     # get list of all the users.
     def get(self, request):
-        users = CustomUser.objects.all()
-        serializer = CustomUserSerializer(users, many=True)
-        return Response(serializer.data)
+        users = CustomUserSerializer.setup_eager_loading(CustomUser.objects.all())
+        paginator = CreloCursorPagination(ordering='id')
+        page = paginator.paginate_queryset(users, request, view=self)
+        serializer = CustomUserSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     # create a new user
     def post(self, request):
@@ -77,27 +83,25 @@ class AuthenticatedUserProfile(APIView):
 
     permission_classes = [IsLoggedInUser]
 
-    def get_object(self):
+    def get_object(self, queryset=None):
+        if queryset is None:
+            queryset = CustomUser.objects.all()
         try:
-            return CustomUser.objects.get(pk=self.request.user.id)
+            return queryset.get(pk=self.request.user.id)
         except CustomUser.DoesNotExist:
             raise Http404
 
-    # get profile of a logged in user
+    # get profile of a logged in user, with the summary counters. Their projects and pledges are at account/projects/ and account/pledges/.
     def get(self, request):
-        user = self.get_object()
+        user = self.get_object(CustomUserSerializer.setup_eager_loading(UserSummarySerializer.setup_eager_loading(CustomUser.objects.all())))
         # if you don't call check_object_permissions here, the view won't check if the user has the right permissions!
         self.check_object_permissions(request, user)
 
         user_serializer = CustomUserSerializer(user)
-        pledges = Pledge.objects.filter(user_id=user.id)
-        pledge_serializer = PledgeSerializer(pledges, many=True)
-        projects = Project.objects.filter(user_id=user.id)
-        project_serializer = ProjectSerializer(projects, many=True)
+        summary_serializer = UserSummarySerializer(user)
         response_data = { 
             "user": user_serializer.data, 
-            "projects": project_serializer.data, 
-            "pledges": pledge_serializer.data 
+            "summary": summary_serializer.data
         }
         return Response(response_data)
 
@@ -110,16 +114,7 @@ class AuthenticatedUserProfile(APIView):
         user_serializer = CustomUserSerializer(user, data=request.data, partial=True)
         if user_serializer.is_valid():
             user_serializer.save()
-            pledges = Pledge.objects.filter(user_id=user.id)
-            pledge_serializer = PledgeSerializer(pledges, many=True)
-            projects = Project.objects.filter(user_id=user.id)
-            project_serializer = ProjectSerializer(projects, many=True)
-            response_data = { 
-                "user": user_serializer.data,
-                "projects": project_serializer.data, 
-                "pledges": pledge_serializer.data 
-            }
-            return Response(response_data)
+            return Response(user_serializer.data)
         return Response(user_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request):
@@ -130,6 +125,34 @@ class AuthenticatedUserProfile(APIView):
         user.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+
+class AccountProjectList(APIView):
+    # the logged in user's projects, newest first.
+
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = FAST_RENDERER_CLASSES
+
+    def get(self, request):
+        fields = requested_fields(request, PROJECT_FIELDS)
+        projects = project_values(Project.objects.filter(user_id=request.user.id), fields)
+        paginator = CreloCursorPagination(ordering='-date_created')
+        page = paginator.paginate_queryset(projects, request, view=self)
+        return paginator.get_paginated_response(project_rows(page, fields))
+
+
+class AccountPledgeList(APIView):
+    # the logged in user's pledges, newest first.
+
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = FAST_RENDERER_CLASSES
+
+    def get(self, request):
+        pledges = pledge_values(Pledge.objects.filter(user_id=request.user.id))
+        paginator = CreloCursorPagination(ordering='-date_created')
+        page = paginator.paginate_queryset(pledges, request, view=self)
+        return paginator.get_paginated_response(pledge_rows(page))
+
+
 class UserAddCategory(APIView):
 
     permission_classes = [IsLoggedInUser]